@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# The app reads its configuration at import time: point it at a throwaway
+# database and keep it away from OpenAI, Telegram and the real index.
+WORK_DIR = tempfile.mkdtemp(prefix="chat-benchmark-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORK_DIR, 'chat_history.db')}",
+    "RAG_VECTOR_DB_PATH": os.path.join(WORK_DIR, "unused_vector_store"),
+    "RAG_EMBEDDING_CACHE_PATH": "",
+    "RAG_INDEX_WATCH_INTERVAL": "0",
+    "LLM_PROVIDER": "openai",
+    "OPENAI_API_KEY": "benchmark",
+    "LLM_WARMUP": "false",
+    "LLM_KEEP_WARM_INTERVAL": "0",
+    "TELEGRAM_BOT_TOKEN": "",
+    "LANGFUSE_PUBLIC_KEY": "",
+    "LANGFUSE_SECRET_KEY": "",
+})
+
+import httpx
+from langchain_community.vectorstores import FAISS
+
+from app.benchmarks.fakes import FakeEmbeddings, FakeChatModel
+from app.core.database import AsyncSessionLocal
+from app.data.preprocessing import DATA_DIR, load_documents, split_documents
+from app.services import chat_service
+from app.services.lexical_index import BM25Index, LEXICAL_INDEX_FILE
+from app.services.mmap_store import write_docstore, write_faiss_index
+from app.services.rag_service import RAGService
+import app.main as main
+
+BASELINE_PATH = os.path.join(project_root, "benchmarks", "chat_baseline.json")
+SCENARIOS = ("chat", "http")
+OFF_TOPIC_QUERIES = [
+    "هوای تهران فردا چطور است؟",
+    "بهترین رستوران نزدیک دانشگاه کجاست؟",
+    "what is the capital of France?",
+]
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    # Replaces obj.name with a coroutine function that records its duration.
+    def wrap(self, obj, name, stage):
+        original = getattr(obj, name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(obj, name, timed)
+
+    def summary(self):
+        stages = {}
+        for stage, values in sorted(self.samples.items()):
+            ms = np.asarray(values) * 1000
+            stages[stage] = {
+                "count": len(values),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            }
+        return stages
+
+
+def build_store(directory, chunks, embeddings):
+    db = FAISS.from_documents(chunks, embeddings)
+    write_faiss_index(directory, db.index)
+    write_docstore(directory, chunks)
+    BM25Index.build(chunks, include_documents=False).save(
+        os.path.join(directory, LEXICAL_INDEX_FILE))
+
+
+# Questions are the opening words of random chunks, so most of them retrieve
+# something; a share of off-topic ones exercises the no-documents branch.
+def make_queries(chunks, n, seed, off_topic_ratio=0.1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        if rng.random() < off_topic_ratio:
+            queries.append(rng.choice(OFF_TOPIC_QUERIES))
+        else:
+            words = rng.choice(chunks).page_content.split()
+            queries.append(" ".join(words[:rng.randint(5, 12)]))
+    return queries
+
+
+async def run_concurrently(jobs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(job):
+        async with semaphore:
+            await job()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(job) for job in jobs))
+    return time.perf_counter() - start
+
+
+async def chat_scenario(queries, sessions, concurrency, timer, rag_service, llm):
+    def job(i, query):
+        async def run():
+            start = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                await chat_service.generate_chat_response(
+                    query, f"bench-chat-{i % sessions}", db, rag_service, llm)
+            timer.record("chat_total", time.perf_counter() - start)
+        return run
+
+    return await run_concurrently([job(i, q) for i, q in enumerate(queries)], concurrency)
+
+
+async def http_scenario(queries, sessions, concurrency, timer):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        def job(i, query):
+            async def run():
+                start = time.perf_counter()
+                response = await client.post(
+                    "/chat", json={"query": query, "session_id": f"bench-http-{i % sessions}"})
+                response.raise_for_status()
+                timer.record("http_chat", time.perf_counter() - start)
+            return run
+
+        return await run_concurrently([job(i, q) for i, q in enumerate(queries)], concurrency)
+
+
+async def run_benchmark(args):
+    embeddings = FakeEmbeddings(latency=args.embedding_latency)
+    docs = load_documents(DATA_DIR)
+    chunks = split_documents(docs)
+    store_dir = os.path.join(WORK_DIR, "vector_store")
+    os.makedirs(store_dir)
+    build_store(store_dir, chunks, embeddings)
+
+    timer = StageTimer()
+    rag_service = RAGService(vector_db_path=store_dir, embeddings=embeddings)
+    rag_service.answer_cache.max_entries = args.answer_cache_size
+    llm = FakeChatModel(
+        first_token_latency=args.llm_latency,
+        token_latency=args.token_latency,
+        answer_tokens=args.answer_tokens,
+        timer=timer
+    )
+
+    timer.wrap(rag_service, "aembed_query", "embedding")
+    timer.wrap(rag_service, "agenerate_augmented_prompt", "retrieval_and_prompt")
+    timer.wrap(chat_service, "_get_history", "history")
+    main.rag_service, main.llm = rag_service, llm
+
+    queries = make_queries(chunks, args.requests, args.seed)
+    throughput = {}
+    async with main.app.router.lifespan_context(main.app):
+        for scenario in args.scenarios:
+            if scenario == "chat":
+                elapsed = await chat_scenario(
+                    queries, args.sessions, args.concurrency, timer, rag_service, llm)
+            else:
+                elapsed = await http_scenario(
+                    queries, args.sessions, args.concurrency, timer)
+            throughput[scenario] = round(len(queries) / elapsed, 2)
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "sessions": args.sessions,
+            "llm_latency": args.llm_latency,
+            "token_latency": args.token_latency,
+            "answer_tokens": args.answer_tokens,
+            "embedding_latency": args.embedding_latency,
+            "chunks": len(chunks),
+        },
+        "throughput_rps": throughput,
+        "stages": timer.summary(),
+        "embedding_calls": embeddings.calls,
+        "embedding_batches": rag_service.embedding_batcher.stats(),
+        "context_packing": rag_service.context_packer.stats(),
+    }
+
+
+def print_report(result):
+    print(f"\n{'stage':<24}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for stage, s in result["stages"].items():
+        print(f"{stage:<24}{s['count']:>7}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+              f"{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+    for scenario, rps in result["throughput_rps"].items():
+        print(f"Throughput ({scenario}): {rps} req/s")
+
+
+# A stage regresses when its p95 grows by more than `tolerance` (relative)
+# and by at least `min_delta_ms`, so sub-millisecond noise is ignored.
+def compare_to_baseline(result, baseline, tolerance, min_delta_ms=1.0):
+    if baseline["config"] != result["config"]:
+        print("Warning: baseline was recorded with a different configuration.")
+
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        current = result["stages"].get(stage)
+        if current is None:
+            continue
+        delta = current["p95_ms"] - base["p95_ms"]
+        if delta > min_delta_ms and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{stage}: p95 {base['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline latency benchmark of the chat path with fake LLM/embedding backends.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=20,
+                        help="Distinct session ids; requests cycle through them to build history.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--llm-latency", type=float, default=0.2,
+                        help="Seconds before the fake LLM's first token.")
+    parser.add_argument("--token-latency", type=float, default=0.005,
+                        help="Seconds per generated token.")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=0.05,
+                        help="Seconds per embedding API call.")
+    parser.add_argument("--answer-cache-size", type=int, default=0,
+                        help="Semantic answer cache entries (0 measures the uncached path).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the full result as JSON.")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH,
+                        help=f"Store the result as the baseline (default {BASELINE_PATH}).")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH,
+                        help="Compare p95s against a stored baseline; exits 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    try:
+        result = asyncio.run(run_benchmark(args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+    print_report(result)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=4, ensure_ascii=False)
+            print(f"Saved results to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(result, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("No regressions against baseline.")
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.services.lexical_index import tokenize
+
+ANSWER_WORDS = [
+    "طبق", "آیین‌نامه", "دانشجو", "واحد", "ترم", "مجاز", "است", "شورای",
+    "آموزشی", "دانشگاه", "حداقل", "حداکثر", "درس", "نمره", "معدل", "می‌تواند",
+]
+
+
+class FakeEmbeddings(Embeddings):
+    # Hashed bag-of-words vectors: deterministic, and queries that share words
+    # with a chunk land near it, so retrieval behaves like the real thing.
+    # `latency` is paid once per API call, like a round-trip.
+    def __init__(self, dim=256, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    # Answers are derived from the question, so runs are repeatable; timing
+    # is first_token_latency plus token_latency per generated token.
+    first_token_latency: float = 0.2
+    token_latency: float = 0.005
+    answer_tokens: int = 60
+    timer: Optional[Any] = None
+
+    @property
+    def _llm_type(self):
+        return "fake-benchmark"
+
+    def _tokens(self, messages):
+        digest = hashlib.sha256(messages[-1].content.encode("utf-8")).digest()
+        return [
+            ANSWER_WORDS[digest[i % len(digest)] % len(ANSWER_WORDS)] + " "
+            for i in range(self.answer_tokens)
+        ]
+
+    def _result(self, tokens, start):
+        if self.timer:
+            self.timer.record("llm", time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self.token_latency * len(tokens))
+        return self._result(tokens, start)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * len(tokens))
+        return self._result(tokens, start)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+            time.sleep(self.token_latency)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        await asyncio.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+            await asyncio.sleep(self.token_latency)
+        if self.timer:
+            self.timer.record("llm", time.perf_counter() - start)
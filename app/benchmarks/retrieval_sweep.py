@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import itertools
+import tempfile
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# Keep sweep vectors out of the real query embedding cache and don't start
+# background reloads of the throwaway indexes.
+WORK_DIR = tempfile.mkdtemp(prefix="retrieval-sweep-")
+os.environ.update({
+    "RAG_EMBEDDING_CACHE_PATH": "",
+    "RAG_INDEX_WATCH_INTERVAL": "0",
+})
+
+from app.benchmarks.fakes import FakeEmbeddings
+from app.core.config import OLLAMA_BASE_URL, RAG_EMBEDDING_MODEL
+from app.core.normalization import normalize_text
+from app.data.preprocessing import (
+    DATA_DIR, ChunkEmbeddingStore, chunk_hash, load_documents, split_documents
+)
+from app.services.ann_index import INDEX_TYPES, build_index, save_index_params
+from app.services.lexical_index import BM25Index, LEXICAL_INDEX_FILE
+from app.services.mmap_store import write_docstore, write_faiss_index
+from app.services.rag_service import RAGService, VectorStoreSnapshot
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_questions.jsonl")
+EMBED_BATCH_SIZE = 256
+
+
+# "fake[:dim]" needs nothing but numpy; "ollama:<model>" and "hf:<model>"
+# run locally; "openai[:<model>]" calls the API.
+def make_embeddings(spec):
+    name, _, model = spec.partition(":")
+    if name == "fake":
+        return FakeEmbeddings(dim=int(model or 256))
+    if name == "ollama":
+        from langchain_ollama import OllamaEmbeddings
+        return OllamaEmbeddings(model=model, base_url=OLLAMA_BASE_URL)
+    if name == "hf":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model)
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model or RAG_EMBEDDING_MODEL, check_embedding_ctx_length=False)
+    raise ValueError(f"Unknown embedding backend '{spec}'. Expected fake, ollama, hf or openai.")
+
+
+# Each line: {"query", "evidence", "url"}. A retrieved chunk is relevant when
+# it comes from the document at `url` and contains the evidence phrase.
+def load_questions(path):
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item["query"] = normalize_text(item["query"])
+                item["evidence"] = normalize_text(item["evidence"])
+                questions.append(item)
+    return questions
+
+
+def is_relevant(doc, question):
+    if question.get("url") and doc.metadata.get("url") != question["url"]:
+        return False
+    return question["evidence"] in normalize_text(doc.page_content)
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def parse_bool(value):
+    return value.strip().lower() in ("1", "true", "on", "yes")
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(path) for name in files)
+
+
+# Chunk vectors are shared by every configuration (and, with --embedding-cache,
+# across runs); identical chunks are embedded once.
+def embed_chunks(chunks, embeddings, store, model):
+    hashes = [chunk_hash(c) for c in chunks]
+    vectors = store.get_many(set(hashes), model)
+
+    pending = list({h: c.page_content for h, c in zip(hashes, chunks) if h not in vectors}.items())
+    for i in range(0, len(pending), EMBED_BATCH_SIZE):
+        batch = pending[i:i + EMBED_BATCH_SIZE]
+        items = list(zip([h for h, _ in batch], embeddings.embed_documents([text for _, text in batch])))
+        store.put_many(items, model)
+        vectors.update(items)
+    return [vectors[h] for h in hashes], len(pending)
+
+
+# Builds the same files preprocessing.py publishes, in a scratch directory.
+def build_store(directory, docs, embeddings, store, model, chunk_size, chunk_overlap,
+                header_levels, index_type):
+    start = time.perf_counter()
+    chunks = split_documents(docs, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                             header_levels=header_levels)
+    split_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors, embedded = embed_chunks(chunks, embeddings, store, model)
+    embed_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index, index_params = build_index(vectors, index_type=index_type)
+    index_s = time.perf_counter() - start
+
+    os.makedirs(directory)
+    write_faiss_index(directory, index)
+    write_docstore(directory, chunks)
+    save_index_params(directory, index_params)
+    BM25Index.build(chunks, include_documents=False).save(os.path.join(directory, LEXICAL_INDEX_FILE))
+
+    return {
+        "chunks": len(chunks),
+        "mean_chunk_chars": round(float(np.mean([len(c.page_content) for c in chunks])), 1),
+        "embedded_chunks": embedded,
+        "split_s": round(split_s, 3),
+        "embed_s": round(embed_s, 3),
+        "index_build_s": round(index_s, 3),
+        "index_mb": round(faiss.serialize_index(index).nbytes / 2 ** 20, 3),
+        "store_mb": round(directory_size(directory) / 2 ** 20, 3),
+    }
+
+
+# Retrieval goes through RAGService with the production fusion and
+# threshold logic; query vectors are computed once per run.
+async def evaluate(rag_service, questions, vectors, k, score_threshold, hybrid):
+    rag_service.k = k
+    rag_service.score_threshold = score_threshold
+    snapshot = rag_service.snapshot
+    if not hybrid:
+        rag_service.snapshot = VectorStoreSnapshot(
+            snapshot.path, snapshot.vector_db, snapshot.retriever, None,
+            snapshot.index_version, snapshot.index_params)
+
+    latencies, reciprocal_ranks, returned, context_chars = [], [], [], []
+    try:
+        for question, vector in zip(questions, vectors):
+            start = time.perf_counter()
+            docs = (await rag_service._aretrieve_documents_batch([question["query"]], [vector]))[0]
+            latencies.append(time.perf_counter() - start)
+
+            rank = next((i + 1 for i, doc in enumerate(docs) if is_relevant(doc, question)), None)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            returned.append(len(docs))
+            context_chars.append(sum(len(doc.page_content) for doc in docs))
+    finally:
+        rag_service.snapshot = snapshot
+
+    ms = np.asarray(latencies) * 1000
+    return {
+        "recall_at_k": round(float(np.mean([rr > 0 for rr in reciprocal_ranks])), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "empty_rate": round(float(np.mean([n == 0 for n in returned])), 4),
+        "mean_returned": round(float(np.mean(returned)), 2),
+        "mean_context_chars": round(float(np.mean(context_chars)), 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+    }
+
+
+async def run_sweep(args):
+    questions = load_questions(args.questions)
+    embeddings = make_embeddings(args.embeddings)
+    store = ChunkEmbeddingStore(args.embedding_cache or os.path.join(WORK_DIR, "chunk_embeddings.sqlite3"))
+    docs = load_documents(DATA_DIR)
+
+    vectors = embeddings.embed_documents([q["query"] for q in questions])
+    retrieval_grid = list(itertools.product(args.ks, args.thresholds, args.hybrid))
+
+    results = []
+    try:
+        builds = itertools.product(args.chunk_sizes, args.overlaps, args.header_levels, args.index_types)
+        for n, (chunk_size, overlap, header_levels, index_type) in enumerate(builds):
+            if overlap >= chunk_size:
+                continue
+            build_config = {"chunk_size": chunk_size, "chunk_overlap": overlap,
+                            "header_levels": header_levels, "index_type": index_type}
+            print(f"Building {build_config}...")
+            build = build_store(
+                os.path.join(WORK_DIR, f"store-{n}"), docs, embeddings, store, args.embeddings,
+                chunk_size, overlap, header_levels, index_type)
+
+            rag_service = RAGService(vector_db_path=os.path.join(WORK_DIR, f"store-{n}"),
+                                     embeddings=embeddings)
+            for k, threshold, hybrid in retrieval_grid:
+                metrics = await evaluate(rag_service, questions, vectors, k, threshold, hybrid)
+                results.append({
+                    "config": {**build_config, "k": k, "score_threshold": threshold, "hybrid": hybrid},
+                    "build": build,
+                    "retrieval": metrics,
+                })
+    finally:
+        store.close()
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "embeddings": args.embeddings,
+        "questions": len(questions),
+        "results": results,
+    }
+
+
+def print_report(report):
+    header = ("size", "overlap", "hdr", "index", "k", "thresh", "hybrid", "chunks",
+              "index_mb", "build_s", "recall", "mrr", "empty", "p95_ms")
+    print("\n" + "".join(f"{h:>10}" for h in header))
+    for row in report["results"]:
+        c, b, r = row["config"], row["build"], row["retrieval"]
+        values = (c["chunk_size"], c["chunk_overlap"], c["header_levels"], c["index_type"], c["k"],
+                  c["score_threshold"], "on" if c["hybrid"] else "off", b["chunks"], b["index_mb"],
+                  round(b["embed_s"] + b["index_build_s"], 2), r["recall_at_k"], r["mrr"],
+                  r["empty_rate"], r["p95_ms"])
+        print("".join(f"{v:>10}" for v in values))
+
+    best = max(report["results"], key=lambda row: (row["retrieval"]["mrr"], row["retrieval"]["recall_at_k"]))
+    print(f"\nBest MRR over {report['questions']} questions ({report['embeddings']}): {best['config']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunking and retrieval settings on a labeled question set.")
+    parser.add_argument("--embeddings", default="fake",
+                        help="Embedding backend: fake[:dim], ollama:<model>, hf:<model> or openai[:<model>].")
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--chunk-sizes", type=lambda v: parse_list(v, int), default=[300, 450, 800])
+    parser.add_argument("--overlaps", type=lambda v: parse_list(v, int), default=[0, 70])
+    parser.add_argument("--header-levels", type=lambda v: parse_list(v, int), default=[3])
+    parser.add_argument("--index-types", type=lambda v: parse_list(v), default=["flat"],
+                        help=f"Comma-separated subset of {INDEX_TYPES}.")
+    parser.add_argument("--ks", type=lambda v: parse_list(v, int), default=[3, 5, 10])
+    parser.add_argument("--thresholds", type=lambda v: parse_list(v, float), default=[0.1])
+    parser.add_argument("--hybrid", type=lambda v: parse_list(v, parse_bool), default=[True, False],
+                        help="Comma-separated on/off values for BM25 fusion.")
+    parser.add_argument("--embedding-cache",
+                        help="SQLite file to keep chunk embeddings in between runs (default: discarded).")
+    parser.add_argument("--output", help="Write the full results as JSON.")
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.run(run_sweep(args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
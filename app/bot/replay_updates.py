@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import httpx
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.config import TELEGRAM_WEBHOOK_SECRET
+
+DEFAULT_URL = "http://localhost:8000/telegram/webhook"
+
+
+# Posts recorded Telegram update payloads (one JSON object per line, as
+# Telegram sends them) to the webhook route, e.g. to exercise a local
+# server running with TELEGRAM_MODE=webhook.
+def replay(path, url=DEFAULT_URL, secret=TELEGRAM_WEBHOOK_SECRET, delay=0.0):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    sent = failed = 0
+
+    with httpx.Client(timeout=10.0) as client, open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            payload = json.loads(line)
+            response = client.post(url, json=payload, headers=headers)
+            if response.is_success:
+                sent += 1
+            else:
+                failed += 1
+                print(f"Update {payload.get('update_id')}: HTTP {response.status_code} {response.text}")
+            if delay:
+                time.sleep(delay)
+
+    print(f"Replayed {sent} updates ({failed} failed).")
+    return sent, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded Telegram updates against the webhook route.")
+    parser.add_argument("path", help="JSONL file with one update payload per line.")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--secret", default=TELEGRAM_WEBHOOK_SECRET)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="Seconds to wait between updates.")
+    args = parser.parse_args()
+
+    replay(args.path, url=args.url, secret=args.secret, delay=args.delay)
@@ -1,12 +1,22 @@
+import time
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from app.core.config import TELEGRAM_BOT_TOKEN
-from app.services.chat_service import generate_chat_response
-from app.core.database import SessionLocal
+from telegram.error import BadRequest
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, filters, ContextTypes
+from app.core.config import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_STREAM_EDIT_INTERVAL,
+    TELEGRAM_MAX_WORKERS, TELEGRAM_MAX_PENDING_PER_USER, TELEGRAM_MAX_SEND_RATE,
+    TELEGRAM_MODE, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_SECRET
+)
+from app.bot.update_processor import PerUserUpdateProcessor
+from app.services.chat_service import stream_chat_response
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import TELEGRAM_QUEUE_TIME
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
 
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("سلام! من دستیار هوشمند دانشگاه صنعتی شریف هستم. هر سوالی در مورد آیین‌نامه‌ها و مقررات آموزشی دارید، بپرسید.")
@@ -16,9 +26,77 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("I can answer questions based on the university's educational regulations. Just type your question!")
 
 
+def _format_sources(sources):
+    if not sources:
+        return ""
+
+    text = "\n\n📚 **منابع:**"
+
+    seen_titles = set()
+    display_sources = []
+
+    for source in sources:
+        title = source.get('title', 'Unknown Source')
+        if title not in seen_titles:
+            seen_titles.add(title)
+            display_sources.append(source)
+
+    for i, source in enumerate(display_sources[:5], 1):
+        title = source.get('title', 'Unknown Source')
+        url = source.get('url')
+        if url:
+            text += f"\n{i}. [{title}]({url})"
+        else:
+            text += f"\n{i}. {title}"
+
+    return text
+
+
+# Pieces of at most `limit` characters, cut at a line break or space where
+# possible. Counting the raw Markdown is conservative: Telegram applies the
+# limit to the rendered text.
+def _split_message(text: str, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH):
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+# The first part replaces the streamed reply; the rest follow as new messages.
+async def _finalize_reply(update: Update, reply, text: str):
+    for i, part in enumerate(_split_message(text)):
+        await _send_part(update, reply if i == 0 else None, part)
+
+
+async def _send_part(update: Update, reply, text: str):
+    try:
+        if reply is None:
+            await update.message.reply_text(text, parse_mode='Markdown')
+        else:
+            await reply.edit_text(text, parse_mode='Markdown')
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+        logger.warning(f"Markdown rendering failed, sending plain text: {e}")
+        if reply is None:
+            await update.message.reply_text(text)
+        else:
+            await reply.edit_text(text)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = update.message.text
     user_id = str(update.effective_user.id)
+    # message.date has one-second resolution and includes polling delay.
+    TELEGRAM_QUEUE_TIME.observe(max(0.0, time.time() - update.message.date.timestamp()))
 
     rag_service = context.bot_data.get("rag_service")
     llm = context.bot_data.get("llm")
@@ -26,54 +104,48 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if rag_service and llm:
         await update.message.reply_chat_action(action="typing")
 
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
-            response_text, sources = await generate_chat_response(
+            sources = []
+            response_text = ""
+            reply = None
+            last_sent = ""
+            last_edit = 0.0
+
+            async for event in stream_chat_response(
                 query=user_text,
                 session_id=user_id,
                 db=db,
                 rag_service=rag_service,
                 llm=llm
-            )
-
-            if sources:
-                response_text += "\n\n📚 **منابع:**"
-
-                seen_urls = set()
-                unique_sources = []
-
-                for source in sources:
-                    url = source.get('url')
-                    if url and url not in seen_urls:
-                        seen_urls.add(url)
-                        unique_sources.append(source)
-                    elif not url:
-                        pass
+            ):
+                if event["type"] == "sources":
+                    sources = event["sources"]
+                    continue
 
-                seen_titles = set()
-                display_sources = []
+                response_text += event["content"]
 
-                for source in sources:
-                    title = source.get('title', 'Unknown Source')
-                    if title not in seen_titles:
-                        seen_titles.add(title)
-                        display_sources.append(source)
+                # Telegram rate-limits edits, so partial answers are pushed
+                # at most once per TELEGRAM_STREAM_EDIT_INTERVAL.
+                now = time.monotonic()
+                if now - last_edit < TELEGRAM_STREAM_EDIT_INTERVAL:
+                    continue
 
-                for i, source in enumerate(display_sources[:5], 1):
-                    title = source.get('title', 'Unknown Source')
-                    url = source.get('url')
-                    if url:
-                        response_text += f"\n{i}. [{title}]({url})"
-                    else:
-                        response_text += f"\n{i}. {title}"
+                partial = response_text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+                if reply is None:
+                    reply = await update.message.reply_text(partial)
+                elif partial != last_sent:
+                    await reply.edit_text(partial)
+                last_sent = partial
+                last_edit = now
 
-            await update.message.reply_text(response_text, parse_mode='Markdown')
+            await _finalize_reply(update, reply, response_text + _format_sources(sources))
 
         except Exception as e:
             logger.error(f"Error processing RAG request: {e}", exc_info=True)
             await update.message.reply_text("Sorry, I encountered an error while processing your request.")
         finally:
-            db.close()
+            await db.close()
     else:
         logger.error("RAG Service or LLM not initialized in bot_data")
         await update.message.reply_text(f"Service temporarily unavailable.")
@@ -85,7 +157,17 @@ def create_bot_app(rag_service, llm):
         logger.warning("TELEGRAM_BOT_TOKEN not found. Bot will not run.")
         return None
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Outbound calls (including streaming edits) are throttled by the rate
+    # limiter; it waits rather than letting Telegram answer 429.
+    builder = Application.builder()\
+        .token(TELEGRAM_BOT_TOKEN)\
+        .concurrent_updates(PerUserUpdateProcessor(
+            max_workers=TELEGRAM_MAX_WORKERS,
+            max_pending_per_user=TELEGRAM_MAX_PENDING_PER_USER))\
+        .rate_limiter(AIORateLimiter(overall_max_rate=TELEGRAM_MAX_SEND_RATE, max_retries=2))
+    if TELEGRAM_MODE == "webhook":
+        builder = builder.updater(None)
+    application = builder.build()
 
     application.bot_data["rag_service"] = rag_service
     application.bot_data["llm"] = llm
@@ -103,3 +185,34 @@ def create_bot_app(rag_service, llm):
         ~filters.TEXT & ~filters.COMMAND, handle_non_text))
 
     return application
+
+
+# In webhook mode updates arrive through the FastAPI route (any worker) and
+# reach this application's update_queue via app/bot/update_relay.py; nothing
+# polls Telegram. The webhook is only (re)registered, never deleted.
+async def start_bot_app(application):
+    await application.initialize()
+    await application.start()
+
+    if application.updater is not None:
+        await application.updater.start_polling()
+    elif TELEGRAM_WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Telegram webhook registered at {TELEGRAM_WEBHOOK_URL}")
+
+
+async def stop_bot_app(application):
+    if application.updater is not None:
+        await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+
+
+async def enqueue_update(application, payload):
+    update = Update.de_json(payload, application.bot)
+    await application.update_queue.put(update)
+    return update
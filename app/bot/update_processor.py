@@ -0,0 +1,91 @@
+import asyncio
+import time
+from contextlib import nullcontext
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from app.core.metrics import (
+    TELEGRAM_UPDATE_WAIT, TELEGRAM_UPDATES_PENDING, TELEGRAM_UPDATES_IN_FLIGHT,
+    TELEGRAM_UPDATES_REJECTED
+)
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+BUSY_TEXT = "لطفاً صبر کنید تا پاسخ سوال‌های قبلی شما آماده شود، سپس دوباره بپرسید."
+
+# Bound on updates accepted by the base class; real concurrency is limited
+# by the worker semaphore below.
+MAX_ACCEPTED_UPDATES = 4096
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Different users are served concurrently by up to max_workers handlers.
+    # One user's updates run strictly in arrival order (asyncio.Lock wakes
+    # waiters FIFO) and only take a worker once it is their turn, so a user
+    # with a backlog never holds slots others could use.
+    def __init__(self, max_workers=16, max_pending_per_user=3):
+        super().__init__(max_concurrent_updates=MAX_ACCEPTED_UPDATES)
+        self.max_workers = max_workers
+        self.max_pending_per_user = max_pending_per_user
+
+        self._workers = None
+        self._users = {}
+
+    async def initialize(self):
+        self._workers = asyncio.Semaphore(self.max_workers)
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+
+        # The update being handled counts too, hence the + 1.
+        if key is not None and entry[1] >= self.max_pending_per_user + 1:
+            coroutine.close()
+            TELEGRAM_UPDATES_REJECTED.inc()
+            await self._reply_busy(update)
+            return
+
+        entry[1] += 1
+        TELEGRAM_UPDATES_PENDING.inc()
+        queued_at = time.perf_counter()
+        started = False
+        try:
+            # Updates without a user (channel posts, polls) skip the ordering.
+            async with entry[0] if key is not None else nullcontext():
+                async with self._workers:
+                    started = True
+                    TELEGRAM_UPDATES_PENDING.dec()
+                    TELEGRAM_UPDATE_WAIT.observe(time.perf_counter() - queued_at)
+                    with TELEGRAM_UPDATES_IN_FLIGHT.track_inprogress():
+                        await coroutine
+        finally:
+            if not started:
+                TELEGRAM_UPDATES_PENDING.dec()
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._users.pop(key, None)
+
+    @staticmethod
+    async def _reply_busy(update):
+        if not isinstance(update, Update) or not update.effective_message:
+            return
+        try:
+            await update.effective_message.reply_text(BUSY_TEXT)
+        except Exception as e:
+            logger.warning(f"Failed to send busy notice: {e!r}")
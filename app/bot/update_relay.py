@@ -0,0 +1,66 @@
+import json
+import asyncio
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.core.database import AsyncSessionLocal, DBTelegramUpdate
+from app.bot.telegram_bot import enqueue_update
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+RELAY_BATCH_SIZE = 100
+
+# Set when this process stored an update, so a relay in the same process
+# picks it up without waiting for the next poll.
+_stored = asyncio.Event()
+
+
+# Webhook POSTs can land on any worker, but only the leader runs the bot
+# (per-user ordering and the history cache are per process). Every worker
+# stores the update in the database; Telegram's retries of an update that is
+# already stored are ignored.
+async def store_update(payload):
+    async with AsyncSessionLocal() as db:
+        insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        await db.execute(
+            insert(DBTelegramUpdate)
+            .values(update_id=payload["update_id"], payload=json.dumps(payload, ensure_ascii=False))
+            .on_conflict_do_nothing(index_elements=["update_id"])
+        )
+        await db.commit()
+    _stored.set()
+
+
+# Runs in the leader: hands stored updates to the bot in update_id order and
+# removes them once queued.
+async def relay_updates(application, interval):
+    while True:
+        rows = []
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(DBTelegramUpdate.update_id, DBTelegramUpdate.payload)
+                    .order_by(DBTelegramUpdate.update_id)
+                    .limit(RELAY_BATCH_SIZE)
+                )
+                rows = result.all()
+                for update_id, payload in rows:
+                    try:
+                        await enqueue_update(application, json.loads(payload))
+                    except Exception as e:
+                        logger.warning(f"Skipping malformed Telegram update {update_id}: {e!r}")
+                if rows:
+                    await db.execute(delete(DBTelegramUpdate).where(
+                        DBTelegramUpdate.update_id.in_([update_id for update_id, _ in rows])))
+                    await db.commit()
+        except Exception as e:
+            logger.error(f"Relaying Telegram updates failed: {e!r}")
+
+        if len(rows) < RELAY_BATCH_SIZE:
+            _stored.clear()
+            try:
+                await asyncio.wait_for(_stored.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
@@ -5,25 +5,168 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv(
     "DATABASE_URL", "sqlite:///./chat_history.db")
+# Derived from DATABASE_URL (aiosqlite / asyncpg) unless set explicitly
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Server processes (run.py); auto-reload only applies with a single worker
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_RELOAD = os.getenv("WEB_RELOAD", "true").lower() == "true"
+# With several workers one process is the leader and runs the singletons
+# (Telegram polling, webhook registration). "auto" elects it with a lock on
+# LEADER_LOCK_FILE; "leader" / "follower" pin the role.
+APP_ROLE = os.getenv("APP_ROLE", "auto").lower()
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "cache/leader.lock")
+# Writable directory shared by the workers so /metrics sums all of them
+# (run.py empties it at startup); unset = metrics of the scraped process only.
+# Stats kept by caches and writers are copied into it every N seconds.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "5"))
+
+# Per-process window cache of recent turns and write-behind batching of
+# message inserts
+HISTORY_CACHE_SESSIONS = int(os.getenv("HISTORY_CACHE_SESSIONS", "10000"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+# Seconds between checks for sessions cleared by other workers (0 = off, only
+# safe with a single worker)
+HISTORY_INVALIDATION_INTERVAL = float(os.getenv("HISTORY_INVALIDATION_INTERVAL", "1"))
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "200"))
+HISTORY_WRITE_INTERVAL_MS = float(os.getenv("HISTORY_WRITE_INTERVAL_MS", "200"))
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+# How long Ollama keeps the model loaded after a request, and its context
+# window (Ollama's default is smaller than RAG_PROMPT_TOKEN_BUDGET)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+# A one-token completion at startup loads the model and opens connections;
+# the keep-warm ping repeats it every LLM_KEEP_WARM_INTERVAL seconds (0 = off)
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() == "true"
+LLM_KEEP_WARM_INTERVAL = float(os.getenv("LLM_KEEP_WARM_INTERVAL", "240"))
+
+# Connection pool shared by the LLM and embedding clients
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "300"))
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Batch answering (POST /chat/batch and app/services/batch_service.py):
+# questions per request, concurrent LLM calls, texts per embedding call
+CHAT_BATCH_MAX_QUERIES = int(os.getenv("CHAT_BATCH_MAX_QUERIES", "500"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+CHAT_BATCH_EMBEDDING_SIZE = int(os.getenv("CHAT_BATCH_EMBEDDING_SIZE", "256"))
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_STREAM_EDIT_INTERVAL = float(
+    os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1.5"))
+# Updates of different users are handled concurrently by up to
+# TELEGRAM_MAX_WORKERS handlers; each user's updates run in order, with at
+# most TELEGRAM_MAX_PENDING_PER_USER queued behind the current one.
+TELEGRAM_MAX_WORKERS = int(os.getenv("TELEGRAM_MAX_WORKERS", "16"))
+TELEGRAM_MAX_PENDING_PER_USER = int(
+    os.getenv("TELEGRAM_MAX_PENDING_PER_USER", "3"))
+# Outbound Bot API calls per second across all chats (Telegram allows ~30)
+TELEGRAM_MAX_SEND_RATE = float(os.getenv("TELEGRAM_MAX_SEND_RATE", "25"))
+# "polling", or "webhook" to receive updates on POST /telegram/webhook. With
+# TELEGRAM_WEBHOOK_URL set, the webhook is registered with Telegram at startup.
+# Webhook mode requires TELEGRAM_WEBHOOK_SECRET.
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling").lower()
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# Webhook updates are stored in the database by whichever worker receives
+# them; the leader checks for updates from other workers every N seconds.
+TELEGRAM_RELAY_INTERVAL = float(os.getenv("TELEGRAM_RELAY_INTERVAL", "0.2"))
 
 RAG_K = int(os.getenv("RAG_K", "5"))
 RAG_VECTOR_DB_PATH = os.getenv("RAG_VECTOR_DB_PATH", "vector_store")
+# Builds are kept as versions under RAG_VECTOR_DB_PATH; servers poll for a new
+# version every RAG_INDEX_WATCH_INTERVAL seconds (0 disables the watcher).
+RAG_VECTOR_STORE_KEEP_VERSIONS = int(
+    os.getenv("RAG_VECTOR_STORE_KEEP_VERSIONS", "3"))
+RAG_INDEX_WATCH_INTERVAL = float(os.getenv("RAG_INDEX_WATCH_INTERVAL", "30"))
 RAG_EMBEDDING_MODEL = os.getenv(
     "RAG_EMBEDDING_MODEL", "text-embedding-3-large")
 RAG_SCORE_THRESHOLD = float(os.getenv("RAG_SCORE_THRESHOLD", "0.1"))
 
+# Hybrid retrieval: BM25 lexical index fused with vector results
+RAG_HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "true").lower() == "true"
+RAG_LEXICAL_MIN_MATCH = float(os.getenv("RAG_LEXICAL_MIN_MATCH", "0.5"))
+# Seconds to wait for a query embedding before falling back to lexical-only
+# retrieval, and how long to stay on that fallback after a failure.
+RAG_EMBEDDING_TIMEOUT = float(os.getenv("RAG_EMBEDDING_TIMEOUT", "3"))
+RAG_EMBEDDING_BACKOFF = float(os.getenv("RAG_EMBEDDING_BACKOFF", "30"))
+
+# Concurrent query embeddings are micro-batched into one API request
+RAG_EMBEDDING_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "16"))
+RAG_EMBEDDING_BATCH_WAIT_MS = float(
+    os.getenv("RAG_EMBEDDING_BATCH_WAIT_MS", "10"))
+
+# Chunking used by preprocessing.py (characters; markdown header levels 1-3
+# that start a new chunk). app/benchmarks/retrieval_sweep.py compares values.
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "450"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "70"))
+RAG_CHUNK_HEADER_LEVELS = int(os.getenv("RAG_CHUNK_HEADER_LEVELS", "3"))
+
+# FAISS index structure built by preprocessing.py: flat, hnsw, ivf or ivfpq.
+# RAG_HNSW_EF_SEARCH / RAG_IVF_NPROBE are stored with the index at build time;
+# setting them when serving overrides the stored values.
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat")
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH") or 0) or None
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "256"))
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE") or 0) or None
+RAG_PQ_M = int(os.getenv("RAG_PQ_M", "64"))
+
+RAG_CHUNK_EMBEDDING_STORE = os.getenv(
+    "RAG_CHUNK_EMBEDDING_STORE", "cache/chunk_embeddings.sqlite3")
+# Index builds: processes for loading/splitting (0 = one per CPU), chunks
+# per embedding request, requests in flight, retries with backoff per batch
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "0"))
+RAG_INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "256"))
+RAG_INGEST_CONCURRENCY = int(os.getenv("RAG_INGEST_CONCURRENCY", "4"))
+RAG_INGEST_MAX_RETRIES = int(os.getenv("RAG_INGEST_MAX_RETRIES", "6"))
+
+# Query embedding cache (empty path disables the on-disk tier)
+RAG_EMBEDDING_CACHE_PATH = os.getenv(
+    "RAG_EMBEDDING_CACHE_PATH", "cache/query_embeddings.sqlite3")
+RAG_EMBEDDING_CACHE_SIZE = int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", "1024"))
+RAG_EMBEDDING_CACHE_DISK_SIZE = int(
+    os.getenv("RAG_EMBEDDING_CACHE_DISK_SIZE", "50000"))
+
+# Semantic answer cache for first-turn questions (size 0 disables it)
+RAG_ANSWER_CACHE_THRESHOLD = float(
+    os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "512"))
+
+# Prompt token budgets: retrieved context is packed first, history gets what
+# is left of the total. Counted with RAG_TOKENIZER_ENCODING (tiktoken);
+# a character estimate is used when the encoding cannot be loaded.
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "2500"))
+RAG_PROMPT_TOKEN_BUDGET = int(os.getenv("RAG_PROMPT_TOKEN_BUDGET", "6000"))
+RAG_TOKENIZER_ENCODING = os.getenv("RAG_TOKENIZER_ENCODING", "o200k_base")
+
 # Langfuse Configuration
 LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY")
 LANGFUSE_SECRET_KEY = os.getenv("LANGFUSE_SECRET_KEY")
-LANGFUSE_HOST = os.getenv("LANGFUSE_HOST")
+# Like the Langfuse SDK, keys alone send traces to Langfuse Cloud.
+LANGFUSE_HOST = os.getenv("LANGFUSE_HOST") or os.getenv("LANGFUSE_BASE_URL") or "https://cloud.langfuse.com"
+
+# Traces go to Langfuse's ingestion API (or TRACE_ENDPOINT, any collector
+# accepting the same payload) from a bounded queue flushed in batches.
+TRACE_ENDPOINT = os.getenv("TRACE_ENDPOINT")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "50"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2.0"))
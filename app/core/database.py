@@ -1,12 +1,74 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import create_engine, event, Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from datetime import datetime
-from app.core.config import SQLALCHEMY_DATABASE_URL
+from app.core.config import (
+    SQLALCHEMY_DATABASE_URL, ASYNC_DATABASE_URL,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+)
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url):
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend in ASYNC_DRIVERS and parsed.drivername in (backend, f"{backend}+pysqlite", f"{backend}+psycopg2"):
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[backend])
+    return parsed
+
+
+def _engine_options(url):
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        options = {"connect_args": {"check_same_thread": False}}
+        if parsed.database in (None, "", ":memory:"):
+            return options
+    else:
+        options = {"pool_pre_ping": True}
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+
+# WAL lets readers run alongside the single writer; NORMAL sync is durable
+# under WAL except for power loss, and busy_timeout makes writers queue
+# instead of failing with "database is locked".
+def _tune_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.close()
+
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, **_engine_options(SQLALCHEMY_DATABASE_URL)
+)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL),
+    **_engine_options(SQLALCHEMY_DATABASE_URL)
 )
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _tune_sqlite)
+if async_engine.dialect.name == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", _tune_sqlite)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 class DBChatSession(Base):
@@ -23,9 +85,29 @@ class DBChatMessage(Base):
     content = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     session = relationship("DBChatSession", back_populates="messages")
+    __table_args__ = (
+        Index("ix_messages_session_id_created_at", "session_id", "created_at"),
+    )
+
+# Webhook updates received by any worker, waiting for the leader's bot
+class DBTelegramUpdate(Base):
+    __tablename__ = "telegram_updates"
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+# Sessions whose history was cleared, so other workers drop their cached copy
+class DBHistoryInvalidation(Base):
+    __tablename__ = "history_invalidations"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes of tables that already exist
+    for index in DBChatMessage.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 def get_db():
     db = SessionLocal()
@@ -33,3 +115,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
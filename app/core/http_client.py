@@ -0,0 +1,42 @@
+import httpx
+
+from app.core.config import (
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY
+)
+
+# One pool per process for the OpenAI chat and embedding clients, so both
+# reuse warm TLS connections instead of each SDK object opening its own.
+_sync_client = None
+_async_client = None
+
+
+def http_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+def get_http_client():
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(limits=http_limits())
+    return _sync_client
+
+
+def get_async_http_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(limits=http_limits())
+    return _async_client
+
+
+async def close_http_clients():
+    global _sync_client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
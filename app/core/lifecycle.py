@@ -0,0 +1,71 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): a lone process leads
+    fcntl = None
+
+from app.core.config import APP_ROLE, LEADER_LOCK_FILE
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _open_lock_file(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return open(path, "a")
+
+
+class LeaderLock(object):
+    # Picks the one worker that runs process-wide singletons. The flock is
+    # held for the life of the process and released by the OS when it exits
+    # or crashes, so a restarted worker can take over.
+    def __init__(self, path=LEADER_LOCK_FILE, role=APP_ROLE):
+        self.path = path
+        self.role = role
+        self.is_leader = False
+        self._file = None
+
+    def acquire(self):
+        if self.role in ("leader", "follower"):
+            self.is_leader = self.role == "leader"
+        elif fcntl is None:
+            self.is_leader = True
+        else:
+            self._file = _open_lock_file(self.path)
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.is_leader = True
+            except BlockingIOError:
+                self._file.close()
+                self._file = None
+                self.is_leader = False
+
+        logger.info(
+            f"Worker {os.getpid()} running as {'leader' if self.is_leader else 'follower'}.")
+        return self.is_leader
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self.is_leader = False
+
+
+# Serializes one-off startup work (e.g. creating tables) across workers
+# booting at the same time.
+@contextmanager
+def startup_lock(path=LEADER_LOCK_FILE + ".init"):
+    if fcntl is None:
+        yield
+        return
+    with _open_lock_file(path) as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
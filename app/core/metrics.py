@@ -0,0 +1,220 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+
+# Imported before prometheus_client, which picks single- or multi-process
+# storage from PROMETHEUS_MULTIPROC_DIR (possibly set in .env) on import.
+from app.core.config import PROMETHEUS_MULTIPROC_DIR
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+STAGE_LATENCY = Histogram(
+    "chat_stage_duration_seconds",
+    "Time spent in each stage of answering a chat message.",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+RETRIEVAL_MISSES = Counter(
+    "rag_retrieval_misses_total",
+    "Queries for which no chunk passed the relevance threshold."
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens sent to and generated by the LLM.",
+    ["kind"]
+)
+CHAT_REQUESTS = Counter(
+    "chat_requests_total",
+    "Chat turns by how they were answered.",
+    ["outcome"]
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "embedding_batch_size",
+    "Distinct queries per embedding request sent by the micro-batcher.",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+)
+TELEGRAM_QUEUE_TIME = Histogram(
+    "telegram_update_queue_seconds",
+    "Time from Telegram receiving a message until its handler starts.",
+    buckets=LATENCY_BUCKETS
+)
+TELEGRAM_UPDATE_WAIT = Histogram(
+    "telegram_update_wait_seconds",
+    "Time an update waited for its user's previous update and a free worker.",
+    buckets=LATENCY_BUCKETS
+)
+TELEGRAM_UPDATES_PENDING = Gauge(
+    "telegram_updates_pending",
+    "Updates received but not yet being handled.",
+    multiprocess_mode="livesum"
+)
+TELEGRAM_UPDATES_IN_FLIGHT = Gauge(
+    "telegram_updates_in_flight",
+    "Updates currently being handled.",
+    multiprocess_mode="livesum"
+)
+TELEGRAM_UPDATES_REJECTED = Counter(
+    "telegram_updates_rejected_total",
+    "Updates turned away because the user already had too many queued."
+)
+
+# Label children are resolved once; observing is then a lock and an add.
+_stages = {}
+
+
+def observe_stage(stage, seconds):
+    child = _stages.get(stage)
+    if child is None:
+        child = _stages.setdefault(stage, STAGE_LATENCY.labels(stage))
+    child.observe(seconds)
+
+
+@contextmanager
+def track_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+async def timed(stage, awaitable):
+    with track_stage(stage):
+        return await awaitable
+
+
+def record_llm_usage(message):
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        LLM_TOKENS.labels("prompt").inc(usage.get("input_tokens", 0))
+        LLM_TOKENS.labels("completion").inc(usage.get("output_tokens", 0))
+
+
+# stats() keys that can go down, with how workers are combined in
+# multi-process mode (disk_entries counts one shared SQLite file). Every other
+# number is a running total and is exported as a counter.
+GAUGE_STATS = {
+    "entries": "livesum",
+    "sessions": "livesum",
+    "pending": "livesum",
+    "memory_entries": "livesum",
+    "disk_entries": "livemax",
+    "mean_batch_size": "liveall",
+    "max_batch_size": "livemax",
+}
+
+
+class StatsCollector(object):
+    # Exposes the counters the caches, batcher and writers already keep via
+    # their stats() methods, read at scrape time instead of on every request.
+    # "hits*"/"misses" become cache_lookups_total.
+    def __init__(self):
+        self.sources = {}
+        self._metrics = {}
+        self._totals = {}
+
+    def register(self, name, stats_fn):
+        self.sources[name] = stats_fn
+
+    def samples(self):
+        for name, stats_fn in list(self.sources.items()):
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            for key, value in (stats or {}).items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key.startswith("hits"):
+                    yield "lookup", name, "hit" + key[4:], value
+                elif key == "misses":
+                    yield "lookup", name, "miss", value
+                elif key in GAUGE_STATS:
+                    yield "gauge", name, key, value
+                else:
+                    yield "counter", name, key, value
+
+    def collect(self):
+        lookups = CounterMetricFamily(
+            "cache_lookups", "Cache lookups by cache and result.", labels=["cache", "result"])
+        families = []
+
+        for kind, name, key, value in self.samples():
+            if kind == "lookup":
+                lookups.add_metric([name, key], value)
+            elif kind == "gauge":
+                families.append(GaugeMetricFamily(
+                    f"{name}_{key}", f"{key} reported by {name}.", value=value))
+            else:
+                families.append(CounterMetricFamily(
+                    f"{name}_{key}", f"{key} reported by {name}.", value=value))
+
+        yield lookups
+        yield from families
+
+    # Multi-process mode: the stats() numbers are copied into prometheus_client
+    # metrics, whose per-process files MultiProcessCollector sums at scrape
+    # time. Counters are advanced by the change since the previous sync.
+    def sync(self):
+        for kind, name, key, value in self.samples():
+            if kind == "gauge":
+                self._metric(Gauge, f"{name}_{key}", f"{key} reported by {name}.",
+                             multiprocess_mode=GAUGE_STATS[key]).set(value)
+                continue
+
+            if kind == "lookup":
+                metric = self._metric(
+                    Counter, "cache_lookups", "Cache lookups by cache and result.",
+                    labelnames=["cache", "result"]).labels(name, key)
+            else:
+                metric = self._metric(Counter, f"{name}_{key}", f"{key} reported by {name}.")
+            previous = self._totals.get((name, key), 0)
+            if value > previous:
+                metric.inc(value - previous)
+            self._totals[(name, key)] = value
+
+    def _metric(self, cls, name, documentation, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, documentation, registry=None, **kwargs)
+        return metric
+
+    async def run_sync(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f"Syncing stats to multi-process metrics failed: {e!r}")
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render_metrics():
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    stats_collector.sync()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# Drops this worker's live gauges from the shared directory on shutdown.
+def mark_process_dead():
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,50 @@
+import re
+
+# Arabic letter forms to their Persian equivalents, Persian and Arabic-Indic
+# digits to ASCII, ZWNJ to a space; diacritics, tatweel, direction marks,
+# BOM and markdown emphasis are dropped. Applied with a single str.translate.
+_FOLD = {
+    "ي": "ی",
+    "ى": "ی",
+    "ك": "ک",
+    "\u0640": None,
+    "\u0670": None,
+    "\u200c": " ",
+    "\u200b": None,
+    "\u200d": None,
+    "\u200e": None,
+    "\u200f": None,
+    "\ufeff": None,
+    "*": None,
+}
+_FOLD.update({chr(c): None for c in range(0x064B, 0x0653)})
+_FOLD.update({chr(0x06F0 + d): str(d) for d in range(10)})
+_FOLD.update({chr(0x0660 + d): str(d) for d in range(10)})
+_TABLE = str.maketrans(_FOLD)
+
+_SPACES = re.compile(r"\s+")
+_LINKS = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+
+
+def fold_text(text):
+    return text.translate(_TABLE)
+
+
+# Queries and cache keys: folded, whitespace collapsed to single spaces.
+def normalize_text(text):
+    return _SPACES.sub(" ", text.translate(_TABLE)).strip()
+
+
+def _collapse_space(match):
+    breaks = match.group().count("\n")
+    if breaks > 1:
+        return "\n\n"
+    return "\n" if breaks else " "
+
+
+# Markdown documents: also strips links to their text, and collapses
+# whitespace while keeping line and paragraph breaks so header splitting
+# still works. Idempotent, so crawled files can be normalized again on load.
+def normalize_document(text):
+    text = _LINKS.sub(r"\1", text.translate(_TABLE))
+    return _SPACES.sub(_collapse_space, text).strip()
@@ -0,0 +1,171 @@
+import asyncio
+import random
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from app.core.config import (
+    LANGFUSE_PUBLIC_KEY, LANGFUSE_SECRET_KEY, LANGFUSE_HOST,
+    TRACE_ENDPOINT, TRACE_SAMPLE_RATE, TRACE_QUEUE_SIZE, TRACE_BATCH_SIZE, TRACE_FLUSH_INTERVAL
+)
+from app.core.http_client import get_async_http_client
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _timestamp(dt=None):
+    return (dt or datetime.now(timezone.utc)).isoformat()
+
+
+class TraceExporter(object):
+    # Process-wide exporter speaking the Langfuse ingestion API. Requests only
+    # enqueue events; a background task posts them in batches. A full queue
+    # drops the new trace instead of making the request wait.
+    def __init__(self, endpoint, auth=None, sample_rate=1.0, max_queue=1000,
+                 batch_size=50, flush_interval=2.0):
+        self.endpoint = endpoint
+        self.auth = auth
+        self.sample_rate = sample_rate
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue = None
+        self._task = None
+
+    @property
+    def enabled(self):
+        return bool(self.endpoint) and self.sample_rate > 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        self._task = None
+
+    async def flush(self):
+        if self._task is not None:
+            await self._queue.join()
+
+    # Decided once per turn, before any trace data is built.
+    def should_sample(self):
+        return self._task is not None and random.random() < self.sample_rate
+
+    def submit(self, events):
+        if self._task is None:
+            return False
+        try:
+            self._queue.put_nowait(events)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            traces = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(traces) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    traces.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._send([event for events in traces for event in events])
+                self.sent += len(traces)
+            except Exception as e:
+                self.failed += len(traces)
+                logger.warning(f"Dropped {len(traces)} traces: {e!r}")
+            finally:
+                for _ in traces:
+                    self._queue.task_done()
+
+    async def _send(self, batch):
+        response = await get_async_http_client().post(
+            self.endpoint,
+            json={"batch": batch},
+            auth=self.auth,
+            timeout=10.0
+        )
+        response.raise_for_status()
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
+
+
+def _event(event_type, body):
+    return {"id": str(uuid.uuid4()), "timestamp": _timestamp(), "type": event_type, "body": body}
+
+
+def chat_trace_events(session_id, query, response_text, metadata, generation=None):
+    trace_id = str(uuid.uuid4())
+    events = [_event("trace-create", {
+        "id": trace_id,
+        "name": "chat",
+        "sessionId": session_id,
+        "input": query,
+        "output": response_text,
+        "metadata": metadata,
+        "timestamp": _timestamp(),
+    })]
+
+    if generation:
+        usage = generation.get("usage") or {}
+        events.append(_event("generation-create", {
+            "id": str(uuid.uuid4()),
+            "traceId": trace_id,
+            "name": "llm",
+            "model": generation.get("model"),
+            "input": generation.get("input"),
+            "output": response_text,
+            "startTime": _timestamp(generation["start"]),
+            "endTime": _timestamp(generation["end"]),
+            "completionStartTime": _timestamp(generation.get("first_token") or generation["end"]),
+            "usage": {
+                "input": usage.get("input_tokens", 0),
+                "output": usage.get("output_tokens", 0),
+                "unit": "TOKENS",
+            },
+        }))
+    return events
+
+
+def _default_endpoint():
+    if TRACE_ENDPOINT:
+        return TRACE_ENDPOINT
+    if LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY and LANGFUSE_HOST:
+        return LANGFUSE_HOST.rstrip("/") + "/api/public/ingestion"
+    return None
+
+
+tracer = TraceExporter(
+    _default_endpoint(),
+    auth=httpx.BasicAuth(LANGFUSE_PUBLIC_KEY, LANGFUSE_SECRET_KEY)
+    if LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY else None,
+    sample_rate=TRACE_SAMPLE_RATE,
+    max_queue=TRACE_QUEUE_SIZE,
+    batch_size=TRACE_BATCH_SIZE,
+    flush_interval=TRACE_FLUSH_INTERVAL
+)
@@ -1,7 +1,14 @@
 import os
+import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import re
 from markdownify import markdownify
 
@@ -13,12 +20,101 @@ SHARIF_AC_MOTHER_LINKS = [
 
 project_root = os.path.dirname(os.path.dirname(
     os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.normalization import normalize_document
+
 DOWNLOAD_DIR = os.path.join(project_root, "data")
 
+MANIFEST_NAME = "crawl_manifest.json"
+REQUEST_TIMEOUT = 20
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def create_session(pool_size=MAX_WORKERS):
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _host_limit(url):
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_limits[host]
+
+
+def _fetch(session, url, headers=None):
+    with _host_limit(url):
+        return session.get(url, headers=headers or {}, timeout=REQUEST_TIMEOUT)
+
+
+def _rule_folder(title, download_dir):
+    safe_title = re.sub(r'[<>:"/\\|?*]', '_', title)
+    if not safe_title:
+        safe_title = "unknown_rule"
+    return os.path.join(download_dir, safe_title), f"{safe_title}.md"
+
+
+def _load_metadata(rule_folder):
+    metadata_path = os.path.join(rule_folder, "metadata.json")
+    if not os.path.exists(metadata_path):
+        return {}
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_metadata(rule_folder, metadata):
+    metadata_path = os.path.join(rule_folder, "metadata.json")
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=4)
+    print(f"Saved metadata: {metadata_path}")
+
+
+# Returns "changed", "unchanged" or "failed".
+def download_and_convert_rule(url, title, edit_date, session=None, download_dir=DOWNLOAD_DIR, force=False):
+    session = session or create_session(1)
+    rule_folder, filename = _rule_folder(title, download_dir)
+    filepath = os.path.join(rule_folder, filename)
 
-def download_and_convert_rule(url, title, edit_date):
     try:
-        response = requests.get(url)
+        previous = _load_metadata(rule_folder) if os.path.exists(filepath) else {}
+
+        if not force and previous and edit_date != "Unknown" \
+                and previous.get("last_edit_date") == edit_date:
+            print(f"Unchanged (same edit date): {title}")
+            return "unchanged"
+
+        headers = {}
+        if not force and previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if not force and previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+        response = _fetch(session, url, headers)
+
+        if response.status_code == 304:
+            print(f"Unchanged (not modified): {title}")
+            if previous.get("last_edit_date") != edit_date:
+                previous["last_edit_date"] = edit_date
+                _save_metadata(rule_folder, previous)
+            return "unchanged"
+
         response.raise_for_status()
 
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -29,22 +125,26 @@ def download_and_convert_rule(url, title, edit_date):
         if description:
             description.decompose()
 
-        content_to_save = markdownify(str(main_content), heading_style="ATX")
+        # Normalized here so the change check below ignores differences in
+        # letter forms, digits or invisible marks between crawls.
+        content_to_save = normalize_document(
+            markdownify(str(main_content), heading_style="ATX"))
 
-        safe_title = re.sub(r'[<>:"/\\|?*]', '_', title)
-        if not safe_title:
-            safe_title = "unknown_rule"
-
-        rule_folder = os.path.join(DOWNLOAD_DIR, safe_title)
         if not os.path.exists(rule_folder):
             os.makedirs(rule_folder)
 
-        filename = f"{safe_title}.md"
-        filepath = os.path.join(rule_folder, filename)
+        status = "changed"
+        if os.path.exists(filepath):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                if f.read() == content_to_save:
+                    status = "unchanged"
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content_to_save)
-        print(f"Saved content: {filepath}")
+        if status == "changed":
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(content_to_save)
+            print(f"Saved content: {filepath}")
+        else:
+            print(f"Unchanged (same content): {title}")
 
         metadata = {
             "title": title,
@@ -52,49 +152,97 @@ def download_and_convert_rule(url, title, edit_date):
             "last_edit_date": edit_date,
             "file_name": filename
         }
-        metadata_path = os.path.join(rule_folder, "metadata.json")
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=4)
-        print(f"Saved metadata: {metadata_path}")
+        if response.headers.get("ETag"):
+            metadata["etag"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            metadata["last_modified"] = response.headers["Last-Modified"]
+
+        if metadata != previous:
+            _save_metadata(rule_folder, metadata)
+
+        return status
 
     except Exception as e:
         print(f"Failed to process {url}: {e}")
+        return "failed"
 
 
-if __name__ == "__main__":
-    if not os.path.exists(DOWNLOAD_DIR):
-        os.makedirs(DOWNLOAD_DIR)
+def list_rules(base_url, session):
+    response = _fetch(session, base_url)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
 
-    for base_url in SHARIF_AC_MOTHER_LINKS:
-        try:
-            response = requests.get(base_url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+    table = soup.find('table', class_='dataplugin_table')
+
+    rows = table.find_all('tr')
+
+    rules = []
+    for row in rows[1:]:
+        cells = row.find_all('td')
+        if not cells:
+            continue
 
-            table = soup.find('table', class_='dataplugin_table')
+        first_cell = cells[0]
+        link_tag = first_cell.find('a')
 
-            rows = table.find_all('tr')
+        if link_tag and 'href' in link_tag.attrs:
+            href = link_tag['href']
+            title = link_tag.get_text(strip=True)
+            full_url = urljoin(base_url, href)
 
-            for row in rows[1:]:
-                cells = row.find_all('td')
-                if not cells:
-                    continue
+            date_cell = cells[1] if len(cells) > 1 else None
+            edit_date = date_cell.get_text(
+                strip=True) if date_cell else "Unknown"
 
-                first_cell = cells[0]
-                link_tag = first_cell.find('a')
+            print(f"Found Rule: {title} ({edit_date}) -> {full_url}")
+            rules.append((title, full_url, edit_date))
 
-                if link_tag and 'href' in link_tag.attrs:
-                    href = link_tag['href']
-                    title = link_tag.get_text(strip=True)
-                    full_url = urljoin(base_url, href)
+    return rules
 
-                    date_cell = cells[1] if len(cells) > 1 else None
-                    edit_date = date_cell.get_text(
-                        strip=True) if date_cell else "Unknown"
 
-                    print(f"Found Rule: {title} ({edit_date}) -> {full_url}")
+def crawl(mother_links=SHARIF_AC_MOTHER_LINKS, download_dir=DOWNLOAD_DIR, max_workers=MAX_WORKERS, force=False):
+    if not os.path.exists(download_dir):
+        os.makedirs(download_dir)
 
-                    download_and_convert_rule(full_url, title, edit_date)
+    session = create_session(max_workers)
 
+    rules = []
+    for base_url in mother_links:
+        try:
+            rules.extend(list_rules(base_url, session))
         except Exception as e:
             print(f"Error crawling {base_url}: {e}")
+
+    manifest = {
+        "crawled_at": datetime.now(timezone.utc).isoformat(),
+        "changed": [],
+        "unchanged": [],
+        "failed": [],
+    }
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            (title, url, pool.submit(download_and_convert_rule, url, title,
+                                     edit_date, session, download_dir, force))
+            for title, url, edit_date in rules
+        ]
+        for title, url, future in futures:
+            manifest[future.result()].append({"title": title, "url": url})
+
+    manifest_path = os.path.join(download_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+    print(f"Changed: {len(manifest['changed'])}, unchanged: {len(manifest['unchanged'])}, "
+          f"failed: {len(manifest['failed'])}. Manifest: {manifest_path}")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl regulations from ac.sharif.edu.")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-download every rule, ignoring edit dates and validators.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    crawl(max_workers=args.workers, force=args.force)
@@ -1,6 +1,13 @@
 import os
 import json
-import re
+import time
+import random
+import asyncio
+import hashlib
+import sqlite3
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
 from langchain_core.documents import Document
@@ -9,84 +16,105 @@ from langchain_text_splitters import (
     RecursiveCharacterTextSplitter,
 )
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 
 import sys
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-from app.core.config import RAG_EMBEDDING_MODEL, RAG_VECTOR_DB_PATH
+from app.core.normalization import normalize_document
+from app.services.lexical_index import BM25Index, LEXICAL_INDEX_FILE
+from app.services.ann_index import INDEX_TYPES, build_index, save_index_params
+from app.services.mmap_store import write_docstore, write_faiss_index
+from app.services.store_versions import new_version_dir, publish_version, prune_versions
+from app.core.config import (
+    RAG_EMBEDDING_MODEL, RAG_VECTOR_DB_PATH, RAG_CHUNK_EMBEDDING_STORE,
+    RAG_INDEX_TYPE, RAG_HNSW_M, RAG_HNSW_EF_CONSTRUCTION, RAG_HNSW_EF_SEARCH,
+    RAG_IVF_NLIST, RAG_IVF_NPROBE, RAG_PQ_M, RAG_VECTOR_STORE_KEEP_VERSIONS,
+    RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP, RAG_CHUNK_HEADER_LEVELS,
+    RAG_INGEST_WORKERS, RAG_INGEST_BATCH_SIZE, RAG_INGEST_CONCURRENCY, RAG_INGEST_MAX_RETRIES
+)
 
 load_dotenv()
 
 DATA_DIR = os.path.join(project_root, "data")
 VECTOR_DB_DIR = os.path.join(project_root, RAG_VECTOR_DB_PATH)
 EMBEDDING_MODEL_NAME = RAG_EMBEDDING_MODEL
+CHUNK_STORE_PATH = os.path.join(project_root, RAG_CHUNK_EMBEDDING_STORE)
+EMBED_BATCH_SIZE = RAG_INGEST_BATCH_SIZE
+MAX_BACKOFF = 60.0
 
 
-def load_documents(data_dir):
-    docs = []
+def load_document(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = normalize_document(f.read())
 
-    for root, _, files in os.walk(data_dir):
-        for file in files:
-            if file.endswith(".md"):
-                path = os.path.join(root, file)
+    metadata = {}
+    metadata_path = os.path.join(os.path.dirname(path), "metadata.json")
+
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+    metadata["source_file"] = os.path.basename(path)
+    metadata["source_path"] = path
 
-                with open(path, "r", encoding="utf-8") as f:
-                    text = f.read()
-                    text = (
-                        text.replace("ي", "ی")
-                        .replace("ك", "ک")
-                        .replace("\u200c", " ")
-                        .replace("\u200f", "")
-                        .replace("*", "")
-                    )
-                    text = re.sub(r"\[([^\]]+)\]\(([^)]+)\)", r"\1", text)
+    return Document(page_content=text, metadata=metadata)
 
-                metadata = {}
-                metadata_path = os.path.join(root, "metadata.json")
 
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, "r", encoding="utf-8") as f:
-                        metadata = json.load(f)
+# Work is spread over a process pool when workers > 1; results keep the
+# sequential order, so chunk ids and hashes do not depend on it.
+def _map(fn, items, workers):
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ProcessPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(fn, items, chunksize=max(1, len(items) // (workers * 4))))
 
-                metadata["source_file"] = file
-                metadata["source_path"] = path
 
-                docs.append(
-                    Document(page_content=text, metadata=metadata)
-                )
+def load_documents(data_dir, workers=1):
+    paths = []
+
+    for root, _, files in os.walk(data_dir):
+        for file in files:
+            if file.endswith(".md"):
+                paths.append(os.path.join(root, file))
+
+    return _map(load_document, paths, workers)
 
-    return docs
 
+HEADERS = [
+    ("#", "title"),
+    ("##", "section"),
+    ("###", "subsection"),
+]
 
-def split_documents(docs):
 
-    headers = [
-        ("#", "title"),
-        ("##", "section"),
-        ("###", "subsection"),
-    ]
+def _split_document(args):
+    doc, chunk_size, chunk_overlap, header_levels = args
 
     header_splitter = MarkdownHeaderTextSplitter(
-        headers_to_split_on=headers
+        headers_to_split_on=HEADERS[:header_levels]
     )
 
     md_chunks = []
-    for d in docs:
-        splits = header_splitter.split_text(d.page_content)
-        for s in splits:
-            s.metadata.update(d.metadata)
-            md_chunks.append(s)
+    for s in header_splitter.split_text(doc.page_content):
+        s.metadata.update(doc.metadata)
+        md_chunks.append(s)
 
     splitter = RecursiveCharacterTextSplitter(
-        chunk_size=450,
-        chunk_overlap=70,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
         separators=["\n\n\n", "\n\n", "\n", "।", ".", " ", ""],
     )
 
-    final_chunks = splitter.split_documents(md_chunks)
+    return splitter.split_documents(md_chunks)
+
+
+def split_documents(docs, chunk_size=RAG_CHUNK_SIZE, chunk_overlap=RAG_CHUNK_OVERLAP,
+                    header_levels=RAG_CHUNK_HEADER_LEVELS, workers=1):
+
+    jobs = [(d, chunk_size, chunk_overlap, header_levels) for d in docs]
+    final_chunks = [c for chunks in _map(_split_document, jobs, workers) for c in chunks]
 
     for i, c in enumerate(final_chunks):
         c.metadata["chunk_id"] = i
@@ -95,21 +123,207 @@ def split_documents(docs):
     return final_chunks
 
 
-def create_vector_db(chunks):
+# Only page_content is embedded, so metadata (paths, edit dates, ETags) stays
+# out of the key; the model name is part of the store key already.
+def chunk_hash(chunk):
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingStore(object):
+    # Persistent chunk-hash -> vector map, so unchanged chunks are never
+    # re-embedded across builds.
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+            "hash TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (hash, model))"
+        )
+        self.conn.commit()
+
+    def get_many(self, hashes, model):
+        found = {}
+        hashes = list(hashes)
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT hash, vector FROM chunk_embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [model, *batch]
+            )
+            for h, blob in rows:
+                found[h] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items, model):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO chunk_embeddings (hash, model, vector) VALUES (?, ?, ?)",
+            [(h, model, array("f", v).tobytes()) for h, v in items]
+        )
+        self.conn.commit()
+
+    def prune(self, keep_hashes, model):
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (hash TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM keep")
+        self.conn.executemany("INSERT OR IGNORE INTO keep (hash) VALUES (?)",
+                              [(h,) for h in keep_hashes])
+        cursor = self.conn.execute(
+            "DELETE FROM chunk_embeddings WHERE model = ? AND hash NOT IN (SELECT hash FROM keep)",
+            (model,)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def clear(self, model):
+        self.conn.execute("DELETE FROM chunk_embeddings WHERE model = ?", (model,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+async def _embed_with_retry(embeddings, texts, max_retries, stats):
+    for attempt in range(max_retries + 1):
+        try:
+            return await embeddings.aembed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+            stats["retries"] += 1
+            print(f"Embedding batch failed ({e!r}); retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+
+# Up to `concurrency` batches are in flight; each is written to the store as
+# soon as it returns, so an interrupted build resumes from the last finished
+# batch. Stale hashes are only pruned once every chunk has a vector.
+async def embed_chunks(chunks, embeddings, store, model_name=EMBEDDING_MODEL_NAME,
+                       batch_size=EMBED_BATCH_SIZE, concurrency=RAG_INGEST_CONCURRENCY,
+                       max_retries=RAG_INGEST_MAX_RETRIES):
+    hashes = [chunk_hash(c) for c in chunks]
+    vectors = store.get_many(set(hashes), model_name)
+
+    pending = {}
+    for h, c in zip(hashes, chunks):
+        if h not in vectors:
+            pending[h] = c.page_content
+    print(f"Reusing {len(vectors)} stored embeddings, embedding {len(pending)} new/changed chunks.")
+
+    pending = list(pending.items())
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    batches.reverse()
+    stats = {"chunks": 0, "chars": 0, "retries": 0}
+    start = time.perf_counter()
+
+    async def worker():
+        while batches:
+            batch = batches.pop()
+            batch_vectors = await _embed_with_retry(
+                embeddings, [text for _, text in batch], max_retries, stats)
+            items = list(zip([h for h, _ in batch], batch_vectors))
+            store.put_many(items, model_name)
+            vectors.update(items)
+
+            stats["chunks"] += len(batch)
+            stats["chars"] += sum(len(text) for _, text in batch)
+            elapsed = time.perf_counter() - start
+            print(f"Embedded {stats['chunks']}/{len(pending)} chunks "
+                  f"({stats['chunks'] / elapsed:.1f} chunks/s, {stats['chars'] / elapsed:.0f} chars/s).")
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    try:
+        await asyncio.gather(*workers)
+    except Exception:
+        print(f"Embedding stopped after {stats['chunks']}/{len(pending)} chunks; "
+              "finished batches are stored and a re-run resumes from there.")
+        raise
+    finally:
+        for task in workers:
+            task.cancel()
+
+    if pending:
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {len(pending)} chunks in {elapsed:.1f}s "
+              f"({len(pending) / elapsed:.1f} chunks/s, {stats['retries']} retries).")
+
+    removed = store.prune(set(hashes), model_name)
+    if removed:
+        print(f"Removed {removed} embeddings of deleted chunks.")
+
+    return [vectors[h] for h in hashes]
+
+
+def create_vector_db(chunks, full=False, index_type=RAG_INDEX_TYPE,
+                     batch_size=EMBED_BATCH_SIZE, concurrency=RAG_INGEST_CONCURRENCY):
     embeddings = OpenAIEmbeddings(
         model=EMBEDDING_MODEL_NAME
     )
-    db = FAISS.from_documents(chunks, embeddings)
-    db.save_local(VECTOR_DB_DIR)
-    print("Vector DB saved.")
+
+    store = ChunkEmbeddingStore(CHUNK_STORE_PATH)
+    try:
+        if full:
+            store.clear(EMBEDDING_MODEL_NAME)
+        vectors = asyncio.run(embed_chunks(
+            chunks, embeddings, store, batch_size=batch_size, concurrency=concurrency))
+    finally:
+        store.close()
+
+    # Vectors are added in chunk order, matching the docstore row positions.
+    index, index_params = build_index(
+        vectors,
+        index_type=index_type,
+        hnsw_m=RAG_HNSW_M,
+        ef_construction=RAG_HNSW_EF_CONSTRUCTION,
+        ef_search=RAG_HNSW_EF_SEARCH or 64,
+        nlist=RAG_IVF_NLIST,
+        nprobe=RAG_IVF_NPROBE or 16,
+        pq_m=RAG_PQ_M
+    )
+
+    # Each build goes to its own version directory and is published by
+    # atomically repointing CURRENT, so running servers can swap to it.
+    version, version_dir = new_version_dir(VECTOR_DB_DIR)
+    write_faiss_index(version_dir, index)
+    write_docstore(version_dir, chunks)
+    save_index_params(version_dir, index_params)
+    print(f"Vector DB saved ({index_type}).")
+
+    BM25Index.build(chunks, include_documents=False).save(os.path.join(version_dir, LEXICAL_INDEX_FILE))
+    print("Lexical index saved.")
+
+    publish_version(VECTOR_DB_DIR, version)
+    removed = prune_versions(VECTOR_DB_DIR, RAG_VECTOR_STORE_KEEP_VERSIONS)
+    print(f"Published vector store version {version}" +
+          (f" (removed {len(removed)} old versions)." if removed else "."))
 
 
 if __name__ == "__main__":
-    docs = load_documents(DATA_DIR)
+    parser = argparse.ArgumentParser(description="Build the FAISS vector store from data/.")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every chunk instead of reusing stored embeddings.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=RAG_INDEX_TYPE,
+                        help="FAISS index structure to build.")
+    parser.add_argument("--workers", type=int, default=RAG_INGEST_WORKERS or os.cpu_count(),
+                        help="Processes used to load and split documents.")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Chunks per embedding request.")
+    parser.add_argument("--concurrency", type=int, default=RAG_INGEST_CONCURRENCY,
+                        help="Embedding requests in flight.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    docs = load_documents(DATA_DIR, workers=args.workers)
 
     if docs:
         print("Loaded:", len(docs))
-        chunks = split_documents(docs)
-        create_vector_db(chunks)
+        chunks = split_documents(docs, workers=args.workers)
+        print(f"Loaded and split in {time.perf_counter() - start:.1f}s.")
+        create_vector_db(chunks, full=args.full, index_type=args.index_type,
+                         batch_size=args.batch_size, concurrency=args.concurrency)
+        print(f"Build finished in {time.perf_counter() - start:.1f}s.")
     else:
         print("No documents found.")
@@ -1,66 +1,142 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 import uuid
-from sqlalchemy.orm import Session
-from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
+import json
+import asyncio
+import secrets
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.services.rag_service import RAGService
-from app.core.database import DBChatSession, get_db, init_db
+from app.core.database import AsyncSessionLocal, async_engine, get_async_db, init_db
 from app.core.config import (
-    LLM_PROVIDER, OLLAMA_MODEL, OLLAMA_BASE_URL,
-    OPENAI_API_KEY, OPENAI_MODEL, LLM_TEMPERATURE
+    LLM_WARMUP, LLM_KEEP_WARM_INTERVAL, ADMIN_TOKEN, RAG_INDEX_WATCH_INTERVAL,
+    TELEGRAM_MODE, TELEGRAM_WEBHOOK_SECRET, CHAT_BATCH_MAX_QUERIES, CHAT_BATCH_CONCURRENCY,
+    TELEGRAM_BOT_TOKEN, TELEGRAM_RELAY_INTERVAL, PROMETHEUS_MULTIPROC_DIR, METRICS_SYNC_INTERVAL
 )
-from app.services.chat_service import generate_chat_response
-from app.bot.telegram_bot import create_bot_app
+from app.core.http_client import close_http_clients
+from app.core.lifecycle import LeaderLock, startup_lock
+from app.core.metrics import render_metrics, stats_collector, mark_process_dead
+from app.core.tracing import tracer
+from app.services.llm_service import create_llm, warm_up_llm, keep_warm
+from app.services.batch_service import answer_batch
+from app.services.chat_service import (
+    generate_chat_response, stream_chat_response, clear_chat_history, history_writer, history_cache,
+    history_invalidator
+)
+from app.bot.telegram_bot import create_bot_app, start_bot_app, stop_bot_app
+from app.bot.update_relay import store_update, relay_updates
 from contextlib import asynccontextmanager
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
 
-init_db()
-
-rag_service = RAGService()
+# Created in lifespan, not at import: the reloader and every worker import
+# this module, and only serving processes should load the index and models.
+rag_service = None
 llm = None
 bot_app = None
+leader = LeaderLock()
+ready = False
 
-if LLM_PROVIDER == "openai":
-    if not OPENAI_API_KEY:
-        raise ValueError("OPENAI_API_KEY is required for OpenAI provider.")
-    logger.info(f"Initializing OpenAI LLM with model: {OPENAI_MODEL}")
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL,
-        temperature=LLM_TEMPERATURE,
-        api_key=OPENAI_API_KEY
-    )
-else:
-    logger.info(f"Initializing Ollama LLM with model: {OLLAMA_MODEL}")
-    llm = ChatOllama(
-        model=OLLAMA_MODEL,
-        temperature=LLM_TEMPERATURE,
-        base_url=OLLAMA_BASE_URL
-    )
+# Looked up at scrape time so a replaced rag_service is picked up.
+stats_collector.register("query_embedding_cache", lambda: rag_service.embedding_cache.stats())
+stats_collector.register("answer_cache", lambda: rag_service.answer_cache.stats())
+stats_collector.register("embedding_batcher", lambda: rag_service.embedding_batcher.stats())
+stats_collector.register("context_packer", lambda: rag_service.context_packer.stats())
+stats_collector.register("history_cache", history_cache.stats)
+stats_collector.register("history_writer", history_writer.stats)
+stats_collector.register("tracer", tracer.stats)
+
+
+def _init_db():
+    with startup_lock():
+        init_db()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global bot_app
-    bot_app = create_bot_app(rag_service, llm)
+    global rag_service, llm, bot_app, ready
+    # The webhook route is public; without a secret anyone who finds the URL
+    # could post updates and have the bot answer (and message) arbitrary chats.
+    if TELEGRAM_MODE == "webhook" and not TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("TELEGRAM_MODE=webhook requires TELEGRAM_WEBHOOK_SECRET to be set.")
+
+    leader.acquire()
+    history_writer.start()
+    history_invalidator.start()
+    tracer.start()
 
+    # Schema creation and index loading run side by side off the event
+    # loop. Services set before startup (e.g. by the benchmark) are kept.
+    db_ready = asyncio.create_task(asyncio.to_thread(_init_db))
+    if rag_service is None:
+        rag_service = await asyncio.to_thread(RAGService)
+    if llm is None:
+        llm = create_llm()
+    await db_ready
+
+    # Load the model and open pooled connections before taking traffic.
+    if LLM_WARMUP:
+        await asyncio.gather(warm_up_llm(llm), rag_service.awarm_up())
+
+    # Only the leader runs the bot, polling or webhook alike; in webhook mode
+    # every worker accepts updates and the leader relays them to the bot.
+    if leader.is_leader:
+        bot_app = create_bot_app(rag_service, llm)
+
+    update_relay = None
     if bot_app:
-        logger.info("Starting Telegram Bot...")
-        await bot_app.initialize()
-        await bot_app.start()
-        await bot_app.updater.start_polling()
+        logger.info(f"Starting Telegram Bot ({TELEGRAM_MODE})...")
+        await start_bot_app(bot_app)
+        if TELEGRAM_MODE == "webhook":
+            update_relay = asyncio.create_task(relay_updates(bot_app, TELEGRAM_RELAY_INTERVAL))
+
+    index_watcher = None
+    if RAG_INDEX_WATCH_INTERVAL > 0:
+        index_watcher = asyncio.create_task(
+            rag_service.watch_for_updates(RAG_INDEX_WATCH_INTERVAL))
+
+    keep_warm_task = None
+    if LLM_KEEP_WARM_INTERVAL > 0:
+        keep_warm_task = asyncio.create_task(
+            keep_warm(llm, rag_service, LLM_KEEP_WARM_INTERVAL))
+
+    metrics_sync = None
+    if PROMETHEUS_MULTIPROC_DIR:
+        metrics_sync = asyncio.create_task(stats_collector.run_sync(METRICS_SYNC_INTERVAL))
 
+    ready = True
     yield
-    logger.info("Stopping Telegram Bot...")
-    await bot_app.updater.stop()
-    await bot_app.stop()
-    await bot_app.shutdown()
+    ready = False
+
+    if metrics_sync:
+        metrics_sync.cancel()
+
+    if index_watcher:
+        index_watcher.cancel()
+    if keep_warm_task:
+        keep_warm_task.cancel()
+
+    if update_relay:
+        update_relay.cancel()
+    if bot_app:
+        logger.info("Stopping Telegram Bot...")
+        await stop_bot_app(bot_app)
+        bot_app = None
+
+    if rag_service.embedding_batcher:
+        await rag_service.embedding_batcher.stop()
+    await history_invalidator.stop()
+    await history_writer.stop()
+    await tracer.stop()
+    await async_engine.dispose()
+    await close_http_clients()
+    mark_process_dead()
+    leader.release()
 
 app = FastAPI(
     title="SharifAC RAG Chatbot",
@@ -92,13 +168,37 @@ class ChatResponse(BaseModel):
     sources: List[Dict]
 
 
+class BatchChatRequest(BaseModel):
+    queries: List[str]
+    concurrency: Optional[int] = None
+
+
 @app.get("/health")
 async def root() -> bool:
     return True
 
 
+# Readiness, unlike /health: false until startup has finished and while
+# shutting down, or when no vector store could be loaded.
+@app.get("/ready")
+async def readiness():
+    if not ready or rag_service is None or rag_service.vector_db is None:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {
+        "ready": True,
+        "role": "leader" if leader.is_leader else "follower",
+        "index_version": rag_service.index_version,
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_endpoint(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
     session_id = request.session_id if request.session_id else str(
         uuid.uuid4())
 
@@ -120,12 +220,105 @@ async def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
     )
 
 
+def _sse(event: Dict) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    session_id = request.session_id if request.session_id else str(
+        uuid.uuid4())
+
+    async def event_stream():
+        # The session is owned by the generator: it has to outlive the
+        # handler and stay open until the last token has been persisted.
+        db = AsyncSessionLocal()
+        try:
+            async for event in stream_chat_response(
+                query=request.query,
+                session_id=session_id,
+                db=db,
+                rag_service=rag_service,
+                llm=llm
+            ):
+                yield _sse(event)
+            yield _sse({"type": "done", "session_id": session_id})
+        except Exception as e:
+            yield _sse({"type": "error", "detail": str(e)})
+        finally:
+            await db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Session-ID": session_id}
+    )
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN or not x_admin_token or \
+            not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+# Results are streamed as JSON lines in completion order; "index" is the
+# question's position in the request.
+@app.post("/chat/batch", dependencies=[Depends(require_admin)])
+async def chat_batch_endpoint(request: BatchChatRequest):
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > CHAT_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413, detail=f"At most {CHAT_BATCH_MAX_QUERIES} queries per batch")
+    concurrency = max(1, min(request.concurrency or CHAT_BATCH_CONCURRENCY, CHAT_BATCH_CONCURRENCY))
+
+    async def results():
+        try:
+            async for result in answer_batch(request.queries, rag_service, llm, concurrency):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"outcome": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+# Answers as soon as the update is stored; Telegram retries on errors and
+# slow responses, and a retried update_id is stored only once. Any worker
+# can take the request, the leader's bot handles it.
+@app.post("/telegram/webhook")
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(default=None)
+):
+    if TELEGRAM_MODE != "webhook" or not TELEGRAM_BOT_TOKEN:
+        raise HTTPException(status_code=404, detail="Webhook mode is not enabled")
+    if not TELEGRAM_WEBHOOK_SECRET or not secrets.compare_digest(
+            x_telegram_bot_api_secret_token or "", TELEGRAM_WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    try:
+        payload = await request.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get("update_id"), int):
+            raise ValueError("update_id missing")
+    except Exception as e:
+        logger.warning(f"Rejected malformed Telegram update: {e!r}")
+        raise HTTPException(status_code=400, detail="Malformed update")
+
+    await store_update(payload)
+    return {"ok": True}
+
+
+@app.post("/admin/reload-index", dependencies=[Depends(require_admin)])
+async def reload_index(force: bool = False):
+    try:
+        version = await asyncio.to_thread(rag_service.reload, force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+    return {"index_version": version}
+
+
 @app.delete("/history/{session_id}")
-async def clear_history(session_id: str, db: Session = Depends(get_db)):
-    db_session = db.query(DBChatSession).filter(
-        DBChatSession.id == session_id).first()
-    if db_session:
-        db.delete(db_session)
-        db.commit()
+async def clear_history(session_id: str, db: AsyncSession = Depends(get_async_db)):
+    if await clear_chat_history(session_id, db):
         return {"message": "Chat history cleared."}
     raise HTTPException(status_code=404, detail="Session ID not found")
@@ -0,0 +1,87 @@
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_PARAMS_FILE = "index_params.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+
+
+def build_index(vectors, index_type="flat", hnsw_m=32, ef_construction=200, ef_search=64,
+                nlist=256, nprobe=16, pq_m=64):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    params = {"index_type": index_type}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        params.update(hnsw_m=hnsw_m, ef_construction=ef_construction,
+                      ef_search=ef_search)
+
+    else:
+        # k-means wants ~39 training points per centroid; small corpora get
+        # fewer lists (and fewer PQ bits) instead of a failed build.
+        nlist = max(1, min(nlist, n // 39))
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % pq_m:
+                raise ValueError(
+                    f"PQ sub-quantizers ({pq_m}) must divide the vector dimension ({dim}).")
+            nbits = max(1, min(8, int(math.log2(max(2, n // 39)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, nbits)
+            params.update(pq_m=pq_m, pq_nbits=nbits)
+
+        logger.info(f"Training {index_type} index with {nlist} lists on {n} vectors...")
+        index.train(vectors)
+        nprobe = min(nprobe, nlist)
+        params.update(nlist=nlist, nprobe=nprobe)
+
+    index.add(vectors)
+    apply_search_params(index, params)
+    return index, params
+
+
+def apply_search_params(index, params, ef_search=None, nprobe=None):
+    ef_search = ef_search or params.get("ef_search")
+    nprobe = nprobe or params.get("nprobe")
+
+    if isinstance(index, faiss.IndexHNSW) and ef_search:
+        index.hnsw.efSearch = ef_search
+        return {"ef_search": ef_search}
+
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return {}
+    if nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    return {"nprobe": ivf.nprobe}
+
+
+def save_index_params(directory, params):
+    with open(os.path.join(directory, INDEX_PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=4)
+
+
+def load_index_params(directory):
+    path = os.path.join(directory, INDEX_PARAMS_FILE)
+    if not os.path.exists(path):
+        return {"index_type": "flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
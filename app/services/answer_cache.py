@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache(object):
+    # Maps query embeddings to previously generated answers. Entries belong to
+    # one vector-store version and are dropped as soon as another is seen.
+    def __init__(self, threshold=0.95, max_entries=512):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def get(self, vector, version):
+        if self.max_entries <= 0:
+            return None
+
+        query = self._normalize(vector)
+
+        with self._lock:
+            self._check_version(version)
+
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._keys = list(self._entries.keys())
+                self._matrix = np.stack(
+                    [self._entries[k][0] for k in self._keys])
+
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = self._keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, answer, sources = self._entries[key]
+            return answer, list(sources)
+
+    def put(self, vector, version, answer, sources):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._check_version(version)
+
+            self._entries[self._next_id] = (
+                self._normalize(vector), answer, list(sources))
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
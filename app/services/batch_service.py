@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.config import CHAT_BATCH_CONCURRENCY
+from app.core.http_client import close_http_clients
+from app.core.metrics import CHAT_REQUESTS, record_llm_usage, timed
+from app.services.chat_service import NO_ANSWER_TEXT
+from app.services.llm_service import create_llm
+from app.services.rag_service import RAGService
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# Answers independent questions (no session history, no answer cache).
+# Embedding and retrieval run once for the whole batch; LLM calls are fanned
+# out `concurrency` at a time and results are yielded as they complete,
+# tagged with the question's position in `queries`.
+async def answer_batch(queries, rag_service, llm, concurrency=CHAT_BATCH_CONCURRENCY):
+    prompts = await rag_service.agenerate_augmented_prompts(queries)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index, query, system_instruction, docs):
+        result = {"index": index, "query": query, "sources": [doc.metadata for doc in docs]}
+        if not system_instruction:
+            CHAT_REQUESTS.labels("no_answer").inc()
+            return {**result, "response": NO_ANSWER_TEXT, "outcome": "no_answer"}
+
+        messages = [SystemMessage(content=system_instruction), HumanMessage(content=query)]
+        async with semaphore:
+            try:
+                message = await timed("llm", llm.ainvoke(messages))
+            except Exception as e:
+                CHAT_REQUESTS.labels("error").inc()
+                logger.error(f"LLM Generation Error: {str(e)}")
+                return {**result, "response": None, "outcome": "error", "error": str(e)}
+
+        record_llm_usage(message)
+        CHAT_REQUESTS.labels("generated").inc()
+        return {**result, "response": message.content, "outcome": "generated"}
+
+    tasks = [asyncio.create_task(answer(i, query, *prompt))
+             for i, (query, prompt) in enumerate(zip(queries, prompts))]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # The consumer went away (e.g. a client disconnect): stop the rest.
+        for task in tasks:
+            task.cancel()
+
+
+# One question per line, either plain text or a JSON object with "query" and
+# an optional "id" that is copied to the result.
+def read_questions(path):
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                item = json.loads(line)
+                items.append((item.get("id"), item["query"]))
+            else:
+                items.append((None, line))
+    return items
+
+
+async def run(input_path, output_path, concurrency):
+    items = read_questions(input_path)
+    rag_service = RAGService()
+    llm = create_llm()
+
+    start = time.perf_counter()
+    counts = {}
+    out = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    try:
+        async for result in answer_batch([query for _, query in items], rag_service, llm, concurrency):
+            item_id = items[result["index"]][0]
+            if item_id is not None:
+                result["id"] = item_id
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[result["outcome"]] = counts.get(result["outcome"], 0) + 1
+    finally:
+        if output_path:
+            out.close()
+        await close_http_clients()
+
+    elapsed = time.perf_counter() - start
+    print(f"Answered {len(items)} questions in {elapsed:.1f}s "
+          f"({len(items) / elapsed:.2f}/s): {counts}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions and write the results as JSONL.")
+    parser.add_argument("input", help="Questions, one per line (plain text or JSON with 'query' and optional 'id').")
+    parser.add_argument("-o", "--output", help="JSONL output file (default: stdout).")
+    parser.add_argument("--concurrency", type=int, default=CHAT_BATCH_CONCURRENCY,
+                        help="Concurrent LLM calls.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.input, args.output, args.concurrency))
@@ -1,85 +1,267 @@
-from sqlalchemy.orm import Session
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langfuse.callback import CallbackHandler
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
 
-from app.core.database import DBChatSession, DBChatMessage
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages.ai import add_usage
+
+from app.core.database import DBChatSession, DBChatMessage, AsyncSessionLocal
 from app.services.rag_service import RAGService
-from app.core.config import LANGFUSE_PUBLIC_KEY, LANGFUSE_SECRET_KEY, LANGFUSE_HOST
+from app.services.history_store import SessionHistoryCache, HistoryWriter, HistoryInvalidator
+from app.core.config import (
+    HISTORY_CACHE_SESSIONS, HISTORY_CACHE_TTL, HISTORY_WRITE_BATCH_SIZE, HISTORY_WRITE_INTERVAL_MS,
+    HISTORY_INVALIDATION_INTERVAL,
+    RAG_PROMPT_TOKEN_BUDGET
+)
+from app.core.metrics import CHAT_REQUESTS, observe_stage, record_llm_usage, timed
+from app.core.tracing import tracer, chat_trace_events
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
 
+HISTORY_LIMIT = 6
+
+NO_ANSWER_TEXT = "در قوانین موجود جوابی برای این سوال پیدا نکردم."
+
+
+history_cache = SessionHistoryCache(
+    window=HISTORY_LIMIT,
+    max_sessions=HISTORY_CACHE_SESSIONS,
+    ttl=HISTORY_CACHE_TTL
+)
+history_invalidator = HistoryInvalidator(
+    AsyncSessionLocal,
+    history_cache,
+    interval=HISTORY_INVALIDATION_INTERVAL,
+    retention=HISTORY_CACHE_TTL + 60
+)
+history_writer = HistoryWriter(
+    AsyncSessionLocal,
+    batch_size=HISTORY_WRITE_BATCH_SIZE,
+    flush_interval=HISTORY_WRITE_INTERVAL_MS / 1000
+)
+
+
+async def _load_history(db: AsyncSession, session_id: str):
+    result = await db.execute(
+        select(DBChatMessage.role, DBChatMessage.content)
+        .where(DBChatMessage.session_id == session_id)
+        .order_by(DBChatMessage.created_at.desc())
+        .limit(HISTORY_LIMIT)
+    )
+
+    history = [(role, content) for role, content in reversed(result.all())]
+    history_cache.put(session_id, history)
+    return history
+
+
+async def _get_history(db: AsyncSession, session_id: str):
+    history = history_cache.get(session_id)
+    if history is None:
+        history = await _load_history(db, session_id)
+    return history
+
+
+# The session row is created by the writer together with the first messages,
+# so a turn costs no DB round-trip on the request path once the writer runs.
+async def _save_turn(session_id: str, query: str, response_text: str):
+    now = datetime.utcnow()
+    rows = [
+        ('user', query, now),
+        ('ai', response_text, now + timedelta(microseconds=1)),
+    ]
+    history_cache.append(session_id, [(role, content) for role, content, _ in rows])
+
+    if not history_writer.submit(session_id, rows):
+        await history_writer.write_batch([(session_id, rows)])
+
+
+# Bulk deletes instead of db.delete(): the ORM cascade would lazy-load every
+# message of the session first, which AsyncSession cannot do implicitly.
+async def clear_chat_history(session_id: str, db: AsyncSession):
+    await history_writer.flush()
+
+    await db.execute(
+        delete(DBChatMessage).where(DBChatMessage.session_id == session_id))
+    result = await db.execute(
+        delete(DBChatSession).where(DBChatSession.id == session_id))
+    await history_invalidator.publish(db, session_id)
+    await db.commit()
+    return result.rowcount > 0
+
+
+@dataclass
+class _Turn:
+    messages: Optional[List[BaseMessage]] = None
+    sources: List[Dict] = field(default_factory=list)
+    cached_answer: Optional[str] = None
+    cacheable: bool = False
+    index_version: Optional[str] = None
+
+
+async def _prepare_turn(query: str, session_id: str, db: AsyncSession, rag_service: RAGService):
+    index_version = rag_service.index_version
+
+    # History comes from the window cache or, on a miss, a DB query run
+    # while the query is embedded; retrieval and the answer cache then reuse
+    # the cached vector.
+    history, _ = await asyncio.gather(
+        timed("history", _get_history(db, session_id)),
+        timed("embedding", rag_service.aembed_query(query)),
+    )
 
-async def generate_chat_response(query: str, session_id: str, db: Session, rag_service: RAGService, llm):
-    db_session = db.query(DBChatSession).filter(
-        DBChatSession.id == session_id).first()
-    if not db_session:
-        db_session = DBChatSession(id=session_id)
-        db.add(db_session)
-        db.commit()
-        db.refresh(db_session)
+    if not history:
+        cached = await rag_service.alookup_cached_answer(query)
+        if cached:
+            answer, sources = cached
+            return _Turn(sources=sources, cached_answer=answer)
 
-    system_instruction, docs = rag_service.generate_augmented_prompt(query)
+    system_instruction, docs = await rag_service.agenerate_augmented_prompt(query)
 
-    db_messages = db.query(DBChatMessage)\
-        .filter(DBChatMessage.session_id == session_id)\
-        .order_by(DBChatMessage.created_at.desc())\
-        .limit(6)\
-        .all()
+    if not system_instruction and not history:
+        return _Turn()
 
-    has_history = len(db_messages) > 0
+    messages = []
 
-    if not system_instruction and not has_history:
-        response_text = "در قوانین موجود جوابی برای این سوال پیدا نکردم."
-        sources = []
+    if system_instruction:
+        messages.append(SystemMessage(content=system_instruction))
     else:
-        messages = []
+        messages.append(SystemMessage(
+            content="تو یک دستیار هوشمند هستی. به سوالات کاربر پاسخ بده."))
 
-        if system_instruction:
-            messages.append(SystemMessage(content=system_instruction))
-        else:
-            messages.append(SystemMessage(
-                content="تو یک دستیار هوشمند هستی. به سوالات کاربر پاسخ بده."))
+    # History gets whatever the system prompt (with its packed context) and
+    # the query leave of the prompt budget, dropping the oldest turns first.
+    packer = rag_service.context_packer
+    history_budget = RAG_PROMPT_TOKEN_BUDGET - packer.counter.count(messages[0].content) \
+        - packer.counter.count(query)
+    for role, content in packer.fit_history(history, history_budget):
+        if role == 'user':
+            messages.append(HumanMessage(content=content))
+        elif role == 'ai':
+            messages.append(AIMessage(content=content))
 
-        db_messages = db_messages[::-1]
+    messages.append(HumanMessage(content=query))
 
-        for msg in db_messages:
-            if msg.role == 'user':
-                messages.append(HumanMessage(content=msg.content))
-            elif msg.role == 'ai':
-                messages.append(AIMessage(content=msg.content))
+    sources = [doc.metadata for doc in docs] if docs else []
+    return _Turn(messages=messages, sources=sources, cacheable=not history,
+                 index_version=index_version)
 
-        messages.append(HumanMessage(content=query))
 
+def _outcome(turn: _Turn):
+    if turn.cached_answer is not None:
+        return "cached"
+    if turn.messages is None:
+        return "no_answer"
+    return "generated"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+# Only called for sampled turns; the exporter queues the events and returns.
+def _trace_turn(session_id: str, query: str, response_text: str, turn: _Turn, llm, generation):
+    metadata = {
+        "outcome": _outcome(turn),
+        "index_version": turn.index_version,
+        "sources": [source.get("title") for source in turn.sources],
+    }
+    if generation:
+        generation["model"] = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+        generation["input"] = [{"role": m.type, "content": m.content} for m in turn.messages]
+    tracer.submit(chat_trace_events(session_id, query, response_text, metadata, generation))
+
+
+async def generate_chat_response(query: str, session_id: str, db: AsyncSession, rag_service: RAGService, llm):
+    start = time.perf_counter()
+    sampled = tracer.should_sample()
+    generation = None
+    turn = await _prepare_turn(query, session_id, db, rag_service)
+
+    if turn.cached_answer is not None:
+        response_text = turn.cached_answer
+    elif turn.messages is None:
+        response_text = NO_ANSWER_TEXT
+    else:
         try:
-            langfuse_handler = None
-            if LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY:
-                langfuse_handler = CallbackHandler(
-                    public_key=LANGFUSE_PUBLIC_KEY,
-                    secret_key=LANGFUSE_SECRET_KEY,
-                    host=LANGFUSE_HOST,
-                    session_id=session_id
-                )
-
-            config = {"callbacks": [
-                langfuse_handler]} if langfuse_handler else {}
-            response_message = llm.invoke(messages, config=config)
+            llm_start = _now()
+            response_message = await timed("llm", llm.ainvoke(turn.messages))
             response_text = response_message.content
-            if docs:
-                sources = [doc.metadata for doc in docs]
-            else:
-                sources = []
+            record_llm_usage(response_message)
+            if sampled:
+                generation = {"start": llm_start, "end": _now(),
+                              "usage": response_message.usage_metadata}
+        except Exception as e:
+            CHAT_REQUESTS.labels("error").inc()
+            logger.error(f"LLM Generation Error: {str(e)}")
+            raise Exception(f"LLM Generation Error: {str(e)}")
+
+        if turn.cacheable:
+            await rag_service.astore_cached_answer(
+                query, response_text, turn.sources, turn.index_version)
+
+    await timed("persist", _save_turn(session_id, query, response_text))
+
+    CHAT_REQUESTS.labels(_outcome(turn)).inc()
+    observe_stage("total", time.perf_counter() - start)
+    if sampled:
+        _trace_turn(session_id, query, response_text, turn, llm, generation)
+    return response_text, turn.sources
+
 
+# Yields a "sources" event, then "token" events as the LLM generates. The
+# turn is persisted only once the stream has completed.
+async def stream_chat_response(query: str, session_id: str, db: AsyncSession, rag_service: RAGService, llm):
+    start = time.perf_counter()
+    sampled = tracer.should_sample()
+    generation = None
+    turn = await _prepare_turn(query, session_id, db, rag_service)
+
+    yield {"type": "sources", "sources": turn.sources}
+
+    if turn.cached_answer is not None:
+        response_text = turn.cached_answer
+        yield {"type": "token", "content": response_text}
+    elif turn.messages is None:
+        response_text = NO_ANSWER_TEXT
+        yield {"type": "token", "content": response_text}
+    else:
+        parts = []
+        usage = None
+        first_token = None
+        llm_start, llm_started_at = time.perf_counter(), _now()
+        try:
+            async for chunk in llm.astream(turn.messages):
+                if chunk.usage_metadata:
+                    record_llm_usage(chunk)
+                    usage = add_usage(usage, chunk.usage_metadata)
+                if chunk.content:
+                    if not parts:
+                        first_token = _now()
+                        observe_stage("llm_first_token", time.perf_counter() - llm_start)
+                    parts.append(chunk.content)
+                    yield {"type": "token", "content": chunk.content}
         except Exception as e:
+            CHAT_REQUESTS.labels("error").inc()
             logger.error(f"LLM Generation Error: {str(e)}")
             raise Exception(f"LLM Generation Error: {str(e)}")
+        observe_stage("llm", time.perf_counter() - llm_start)
+        response_text = "".join(parts)
+        if sampled:
+            generation = {"start": llm_started_at, "end": _now(),
+                          "first_token": first_token, "usage": usage}
 
-    user_msg = DBChatMessage(session_id=session_id, role='user', content=query)
-    ai_msg = DBChatMessage(session_id=session_id,
-                           role='ai', content=response_text)
+        if turn.cacheable:
+            await rag_service.astore_cached_answer(
+                query, response_text, turn.sources, turn.index_version)
 
-    db.add(user_msg)
-    db.add(ai_msg)
-    db.commit()
+    await timed("persist", _save_turn(session_id, query, response_text))
 
-    return response_text, sources
+    CHAT_REQUESTS.labels(_outcome(turn)).inc()
+    observe_stage("total", time.perf_counter() - start)
+    if sampled:
+        _trace_turn(session_id, query, response_text, turn, llm, generation)
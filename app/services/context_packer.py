@@ -0,0 +1,164 @@
+import math
+import threading
+from collections import defaultdict
+
+import tiktoken
+from langchain_core.documents import Document
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Shortest suffix/prefix match treated as splitter overlap rather than a
+# coincidence; the splitter overlap is 70 characters.
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 200
+MIN_PASSAGE_TOKENS = 64
+
+
+class TokenCounter(object):
+    # tiktoken fetches encodings on first use; offline deployments fall back
+    # to a conservative characters-per-token estimate.
+    def __init__(self, encoding_name="o200k_base", chars_per_token=3.0):
+        self.chars_per_token = chars_per_token
+        try:
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(
+                f"Tokenizer '{encoding_name}' unavailable ({e!r}); estimating token counts.")
+            self.encoding = None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is None:
+            return math.ceil(len(text) / self.chars_per_token)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        if self.encoding is None:
+            return text[:int(max_tokens * self.chars_per_token)]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode(tokens[:max_tokens]).rstrip("�")
+
+
+def _strip_overlap(previous, text):
+    for size in range(min(len(previous), len(text), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return None
+
+
+class ContextPacker(object):
+    # Turns the ranked retrieval results into the context block: consecutive
+    # chunks of the same rule are merged with their shared overlap removed,
+    # then passages are added in rank order until the token budget is spent.
+    def __init__(self, counter):
+        self.counter = counter
+        self.requests = 0
+        self.raw_tokens = 0
+        self.packed_tokens = 0
+        self.history_tokens_dropped = 0
+
+        self._lock = threading.Lock()
+
+    def _merge_adjacent(self, docs):
+        runs = []
+        by_source = defaultdict(list)
+        for rank, doc in enumerate(docs):
+            chunk_id = doc.metadata.get("chunk_id")
+            if chunk_id is None:
+                runs.append((rank, [doc]))
+                continue
+            source = (doc.metadata.get("title"), doc.metadata.get("url"))
+            by_source[source].append((chunk_id, rank, doc))
+
+        for items in by_source.values():
+            items.sort(key=lambda item: item[0])
+            run, best = [], None
+            for chunk_id, rank, doc in items:
+                if run and chunk_id != run[-1].metadata["chunk_id"] + 1:
+                    runs.append((best, run))
+                    run, best = [], None
+                run.append(doc)
+                best = rank if best is None else min(best, rank)
+            runs.append((best, run))
+
+        runs.sort(key=lambda run: run[0])
+        return [run for _, run in runs]
+
+    def _join(self, run):
+        text = run[0].page_content.strip()
+        for doc in run[1:]:
+            part = doc.page_content.strip()
+            rest = _strip_overlap(text, part)
+            if rest is None:
+                text = f"{text}\n{part}"
+            elif rest.strip():
+                text = text + rest if rest[0].isspace() else f"{text} {rest}"
+        return text
+
+    # Returns the passages to show the model and the retrieved chunks they
+    # cover (used as the answer's sources).
+    def pack(self, docs, budget):
+        seen = set()
+        unique = []
+        for doc in docs:
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                unique.append(doc)
+
+        raw = sum(self.counter.count(doc.page_content) for doc in docs)
+        passages, used, packed = [], [], 0
+
+        for run in self._merge_adjacent(unique):
+            text = self._join(run)
+            tokens = self.counter.count(text)
+            remaining = budget - packed
+            if tokens > remaining:
+                if remaining < MIN_PASSAGE_TOKENS:
+                    break
+                text = self.counter.truncate(text, remaining)
+                tokens = self.counter.count(text)
+
+            metadata = dict(run[0].metadata)
+            metadata["chunk_ids"] = [doc.metadata.get("chunk_id") for doc in run]
+            passages.append(Document(page_content=text, metadata=metadata))
+            used.extend(run)
+            packed += tokens
+
+        with self._lock:
+            self.requests += 1
+            self.raw_tokens += raw
+            self.packed_tokens += packed
+
+        logger.debug(
+            f"Packed {len(docs)} chunks into {len(passages)} passages: {raw} -> {packed} tokens.")
+        return passages, used
+
+    # Keeps the most recent (role, content) pairs that fit in the budget.
+    def fit_history(self, history, budget):
+        kept, used = [], 0
+        for role, content in reversed(history):
+            tokens = self.counter.count(content)
+            if used + tokens > budget:
+                break
+            kept.append((role, content))
+            used += tokens
+
+        dropped = sum(self.counter.count(content)
+                      for _, content in history[:len(history) - len(kept)])
+        if dropped:
+            with self._lock:
+                self.history_tokens_dropped += dropped
+        return list(reversed(kept))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "raw_tokens": self.raw_tokens,
+                "packed_tokens": self.packed_tokens,
+                "tokens_saved": self.raw_tokens - self.packed_tokens,
+                "history_tokens_dropped": self.history_tokens_dropped,
+            }
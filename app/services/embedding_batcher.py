@@ -0,0 +1,92 @@
+import asyncio
+from collections import Counter
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.metrics import EMBEDDING_BATCH_SIZE
+
+
+class EmbeddingBatcher(Embeddings):
+    # Queries awaiting an embedding within max_wait seconds of each other are
+    # sent as one embed_documents request and the vectors fanned back out.
+    def __init__(self, embeddings, max_batch_size=16, max_wait=0.01):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.batch_sizes = Counter()
+        self._pending = []
+        self._flush_handle = None
+        # The loop only keeps weak references to tasks; an unreferenced batch
+        # could be collected mid-request and its callers would never resume.
+        self._tasks = set()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text):
+        if self.max_batch_size <= 1:
+            return await self.embeddings.aembed_query(text)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._embed_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # Sends whatever is still queued and waits for in-flight batches.
+    async def stop(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _embed_batch(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batch_sizes[len(texts)] += 1
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+
+        try:
+            vectors = await self.embeddings.aembed_documents(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        queries = sum(size * n for size, n in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "queries": queries,
+            "mean_batch_size": queries / batches if batches else 0.0,
+            "max_batch_size": max(self.batch_sizes, default=0),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
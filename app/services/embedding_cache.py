@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.normalization import normalize_text
+
+
+# Vectors are kept as float32 arrays (4 bytes per dimension instead of a
+# Python float object each) and handed out as fresh lists.
+class QueryEmbeddingCache(object):
+    def __init__(self, path=None, memory_size=1024, disk_size=50000):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_count = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_query_embeddings_last_used "
+                "ON query_embeddings (last_used)"
+            )
+            self._conn.commit()
+            self._disk_count = self._conn.execute(
+                "SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(text, model):
+        return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_memory(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is None:
+                return None
+            self._memory.move_to_end(key)
+            self.hits_memory += 1
+        return vector.tolist()
+
+    def get_disk(self, key):
+        if self._conn is None:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits_disk += 1
+
+        vector = array("f", row[0])
+        self._remember(key, vector)
+        return vector.tolist()
+
+    def get(self, key):
+        vector = self.get_memory(key)
+        if vector is None:
+            vector = self.get_disk(key)
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+        return vector
+
+    def put(self, key, vector):
+        vector = array("f", vector)
+        self._remember(key, vector)
+
+        if self._conn is None:
+            return
+
+        with self._lock:
+            # Only a new row counts towards disk_size; an existing key is
+            # refreshed in place.
+            row = (key, vector.tobytes(), time.time())
+            cursor = self._conn.execute(
+                "INSERT INTO query_embeddings (key, vector, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO NOTHING", row)
+            if cursor.rowcount > 0:
+                self._disk_count += 1
+            else:
+                self._conn.execute(
+                    "UPDATE query_embeddings SET vector = ?, last_used = ? WHERE key = ?",
+                    row[1:] + row[:1])
+
+            overflow = self._disk_count - self.disk_size
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM query_embeddings WHERE key IN ("
+                    "SELECT key FROM query_embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self._disk_count = self._conn.execute(
+                    "SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            self._conn.commit()
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_count,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    # Caches query embeddings only; documents are embedded once at index time.
+    def __init__(self, embeddings, cache, model_name):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text):
+        key = self.cache.make_key(text, self.model_name)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        key = self.cache.make_key(text, self.model_name)
+        vector = await asyncio.to_thread(self.cache.get, key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, key, vector)
+        return vector
+
+    # Many queries at once: cached vectors are reused and the distinct
+    # misses are embedded batch_size texts per request, then cached.
+    async def aembed_queries(self, texts, batch_size=256):
+        keys = [self.cache.make_key(text, self.model_name) for text in texts]
+        vectors = await asyncio.to_thread(lambda: [self.cache.get(key) for key in keys])
+
+        missing = list(dict.fromkeys(
+            text for text, vector in zip(texts, vectors) if vector is None))
+        embedded = {}
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            embedded.update(zip(batch, await self.embeddings.aembed_documents(batch)))
+
+        if embedded:
+            await asyncio.to_thread(lambda: [
+                self.cache.put(self.cache.make_key(text, self.model_name), vector)
+                for text, vector in embedded.items()])
+        return [vector if vector is not None else embedded[text]
+                for text, vector in zip(texts, vectors)]
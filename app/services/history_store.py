@@ -0,0 +1,247 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.core.database import DBChatSession, DBChatMessage, DBHistoryInvalidation
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# Other workers, or the synchronous fallback in chat_service, may create the
+# same session at the same time, so existing ids are skipped by the database
+# instead of being looked up first.
+def _insert_sessions(dialect, session_ids):
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    return insert(DBChatSession).values(
+        [{"id": session_id} for session_id in session_ids]
+    ).on_conflict_do_nothing(index_elements=["id"])
+
+
+class SessionHistoryCache(object):
+    # Last `window` (role, content) pairs per session, LRU-bounded. Entries
+    # expire after `ttl` seconds so other workers' writes become visible.
+    def __init__(self, window=6, max_sessions=10000, ttl=300):
+        self.window = window
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._sessions.pop(session_id, None)
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, session_id, history):
+        with self._lock:
+            self._sessions[session_id] = (
+                time.monotonic(), list(history)[-self.window:])
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def append(self, session_id, items):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            self._sessions[session_id] = (
+                entry[0], (entry[1] + list(items))[-self.window:])
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "sessions": len(self._sessions)}
+
+
+class HistoryInvalidator(object):
+    # Each worker has its own SessionHistoryCache. Clearing a session records
+    # it in the database, and every worker polls for new records and drops
+    # those sessions from its cache, so deleted history is served for at most
+    # `interval` seconds instead of the cache TTL. Records older than
+    # `retention` are pruned whenever a new one is written.
+    def __init__(self, session_factory, cache, interval=1.0, retention=360):
+        self.session_factory = session_factory
+        self.cache = cache
+        self.interval = interval
+        self.retention = retention
+        self.invalidated = 0
+
+        self._last_id = 0
+        self._task = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # Added to the caller's transaction, which deletes the history itself.
+    async def publish(self, db, session_id):
+        self.cache.invalidate(session_id)
+        db.add(DBHistoryInvalidation(session_id=session_id))
+        await db.execute(delete(DBHistoryInvalidation).where(
+            DBHistoryInvalidation.created_at < datetime.utcnow() - timedelta(seconds=self.retention)))
+
+    async def _run(self):
+        async with self.session_factory() as db:
+            result = await db.execute(select(func.max(DBHistoryInvalidation.id)))
+            self._last_id = result.scalar() or 0
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.warning(f"Checking for cleared chat sessions failed: {e!r}")
+
+    async def poll(self):
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(DBHistoryInvalidation.id, DBHistoryInvalidation.session_id)
+                .where(DBHistoryInvalidation.id > self._last_id)
+                .order_by(DBHistoryInvalidation.id))
+            rows = result.all()
+        for row_id, session_id in rows:
+            self.cache.invalidate(session_id)
+            self._last_id = row_id
+        self.invalidated += len(rows)
+
+
+class HistoryWriter(object):
+    # Write-behind queue for chat messages: turns are queued and inserted in
+    # batches, one transaction per batch. Until start() is called (scripts,
+    # tests) submit() returns False and callers write synchronously.
+    def __init__(self, session_factory, batch_size=200, flush_interval=0.2,
+                 max_retries=3, retry_delay=0.5):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.batches = 0
+        self.rows = 0
+        self.retries = 0
+        self.dropped_rows = 0
+
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        self._task = None
+
+    async def flush(self):
+        if self._task is not None:
+            await self._queue.join()
+
+    def submit(self, session_id, rows):
+        if self._task is None:
+            return False
+        self._queue.put_nowait((session_id, rows))
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._persist(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    # A failed batch is retried with exponential backoff (the queue waits
+    # meanwhile); if it still fails, each session is written in its own
+    # transaction so one bad turn does not take unrelated sessions with it.
+    async def _persist(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.write_batch(batch)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.warning(
+                        f"Persisting {len(batch)} chat turns failed ({e!r}); writing per session.")
+                    break
+                delay = self.retry_delay * 2 ** attempt
+                self.retries += 1
+                logger.warning(
+                    f"Persisting {len(batch)} chat turns failed ({e!r}); retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+
+        by_session = {}
+        for session_id, rows in batch:
+            by_session.setdefault(session_id, []).append((session_id, rows))
+        for session_id, turns in by_session.items():
+            try:
+                await self.write_batch(turns)
+            except Exception as e:
+                dropped = sum(len(rows) for _, rows in turns)
+                self.dropped_rows += dropped
+                logger.error(
+                    f"Dropped {dropped} chat messages of session {session_id}: {e}", exc_info=True)
+
+    async def write_batch(self, batch):
+        async with self.session_factory() as db:
+            session_ids = sorted({session_id for session_id, _ in batch})
+            await db.execute(_insert_sessions(db.bind.dialect.name, session_ids))
+
+            messages = [
+                DBChatMessage(session_id=session_id, role=role,
+                              content=content, created_at=created_at)
+                for session_id, rows in batch
+                for role, content, created_at in rows
+            ]
+            db.add_all(messages)
+            await db.commit()
+
+            self.batches += 1
+            self.rows += len(messages)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "retries": self.retries,
+            "dropped_rows": self.dropped_rows,
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
@@ -0,0 +1,114 @@
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+from app.core.normalization import fold_text
+
+LEXICAL_INDEX_FILE = "lexical_index.json"
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(fold_text(text).lower())
+
+
+def reciprocal_rank_fusion(result_lists, k, c=60):
+    scores = defaultdict(float)
+    docs = {}
+
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = (doc.metadata.get("source_file"),
+                   doc.metadata.get("chunk_id"), doc.page_content)
+            scores[key] += 1.0 / (c + rank + 1)
+            docs.setdefault(key, doc)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+
+class BM25Index(object):
+    def __init__(self, postings, doc_lengths, documents, k1=1.5, b=0.75):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+
+        n = len(doc_lengths)
+        self.avg_length = sum(doc_lengths) / n if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in postings.items()
+        }
+
+    # Without include_documents the index only holds postings, and hits are
+    # resolved by position through the vector store's docstore.
+    @classmethod
+    def build(cls, chunks, include_documents=True):
+        postings = defaultdict(list)
+        doc_lengths = []
+        documents = []
+
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk.page_content)
+            doc_lengths.append(len(tokens))
+            if include_documents:
+                documents.append(
+                    {"page_content": chunk.page_content, "metadata": chunk.metadata})
+            for term, tf in Counter(tokens).items():
+                postings[term].append([doc_id, tf])
+
+        return cls(dict(postings), doc_lengths, documents)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "documents": self.documents,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["postings"], data["doc_lengths"], data["documents"])
+
+    # min_match is the fraction of the query's IDF mass a chunk must cover,
+    # which keeps chunks that only share common words out of the results.
+    def search(self, query, k, min_match=0.0):
+        terms = set(tokenize(query))
+        total_idf = sum(self.idf.get(t, 0.0) for t in terms)
+        if not total_idf:
+            return []
+
+        scores = defaultdict(float)
+        matched = defaultdict(float)
+
+        for term in terms:
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b *
+                                  self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_id] += idf
+
+        hits = [d for d in scores if matched[d] / total_idf >= min_match]
+        hits.sort(key=scores.get, reverse=True)
+        return [(d, scores[d]) for d in hits[:k]]
+
+    def get_document(self, doc_id):
+        doc = self.documents[doc_id]
+        return Document(page_content=doc["page_content"], metadata=dict(doc["metadata"]))
+
+    def search_documents(self, query, k, min_match=0.0, lookup=None):
+        lookup = lookup or self.get_document
+        return [lookup(d) for d, _ in self.search(query, k, min_match)]
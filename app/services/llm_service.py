@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from langchain_core.messages import HumanMessage
+
+from app.core.config import (
+    LLM_PROVIDER, OLLAMA_MODEL, OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX,
+    OPENAI_API_KEY, OPENAI_MODEL, LLM_TEMPERATURE
+)
+from app.core.http_client import get_http_client, get_async_http_client, http_limits
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+WARMUP_PROMPT = "سلام"
+
+
+# Only the configured provider's package is imported; each pulls in its own
+# SDK and takes a while to load.
+def create_llm():
+    if LLM_PROVIDER == "openai":
+        if not OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY is required for OpenAI provider.")
+        from langchain_openai import ChatOpenAI
+        logger.info(f"Initializing OpenAI LLM with model: {OPENAI_MODEL}")
+        return ChatOpenAI(
+            model=OPENAI_MODEL,
+            temperature=LLM_TEMPERATURE,
+            api_key=OPENAI_API_KEY,
+            stream_usage=True,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
+        )
+
+    # The ollama client builds its own httpx client; it gets the same limits.
+    from langchain_ollama import ChatOllama
+    logger.info(f"Initializing Ollama LLM with model: {OLLAMA_MODEL}")
+    return ChatOllama(
+        model=OLLAMA_MODEL,
+        temperature=LLM_TEMPERATURE,
+        base_url=OLLAMA_BASE_URL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        client_kwargs={"limits": http_limits()}
+    )
+
+
+# One-token completion. The copy shares the original's clients, and for
+# Ollama keeps num_ctx/keep_alive so the model is not reloaded for real
+# requests. Checked by field so neither provider has to be imported.
+async def warm_up_llm(llm):
+    fields = getattr(type(llm), "model_fields", {})
+    if "num_predict" in fields:
+        probe = llm.model_copy(update={"num_predict": 1})
+    elif "max_tokens" in fields:
+        probe = llm.model_copy(update={"max_tokens": 1})
+    else:
+        probe = llm
+
+    start = time.perf_counter()
+    try:
+        await probe.ainvoke([HumanMessage(content=WARMUP_PROMPT)])
+    except Exception as e:
+        logger.warning(f"LLM warm-up failed: {e!r}")
+        return False
+    logger.info(f"LLM warm-up took {time.perf_counter() - start:.2f}s")
+    return True
+
+
+async def keep_warm(llm, rag_service, interval):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.gather(warm_up_llm(llm), rag_service.awarm_up())
@@ -0,0 +1,104 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+FAISS_INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite3"
+
+
+# The server only reads index.faiss and the SQLite docstore, so builds skip
+# save_local's pickled index.pkl.
+def write_faiss_index(directory, index):
+    path = os.path.join(directory, FAISS_INDEX_FILE)
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def write_docstore(directory, docs):
+    path = os.path.join(directory, DOCSTORE_FILE)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE chunks (position INTEGER PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        conn.executemany(
+            "INSERT INTO chunks (position, page_content, metadata) VALUES (?, ?, ?)",
+            [(i, d.page_content, json.dumps(d.metadata, ensure_ascii=False))
+             for i, d in enumerate(docs)]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+
+
+class SQLiteDocstore(Docstore):
+    # Read-only docstore keyed by FAISS row position; rows are fetched on
+    # demand instead of unpickling the whole corpus into every process.
+    def __init__(self, path):
+        self.conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, search):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT page_content, metadata FROM chunks WHERE position = ?", (int(search),)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def close(self):
+        self.conn.close()
+
+
+class PositionIds(Mapping):
+    def __init__(self, count):
+        self.count = count
+
+    def __getitem__(self, position):
+        position = int(position)
+        if not 0 <= position < self.count:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+    def __len__(self):
+        return self.count
+
+
+def has_mmap_store(directory):
+    return os.path.exists(os.path.join(directory, DOCSTORE_FILE)) and \
+        os.path.exists(os.path.join(directory, FAISS_INDEX_FILE))
+
+
+# IO_FLAG_MMAP_IFC maps the vectors in place (flat and HNSW storage included),
+# so every worker reads the same page-cached copy; IO_FLAG_MMAP would still
+# copy them into private memory.
+def load_mmap_store(directory, embeddings):
+    index = faiss.read_index(
+        os.path.join(directory, FAISS_INDEX_FILE),
+        faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    )
+    docstore = SQLiteDocstore(os.path.join(directory, DOCSTORE_FILE))
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=PositionIds(docstore.count)
+    )
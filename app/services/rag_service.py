@@ -1,8 +1,33 @@
 import os
+import time
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+import faiss
+import numpy as np
 from dotenv import load_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from app.core.config import RAG_VECTOR_DB_PATH, RAG_EMBEDDING_MODEL, RAG_SCORE_THRESHOLD, RAG_K
+from app.core.config import (
+    RAG_VECTOR_DB_PATH, RAG_EMBEDDING_MODEL, RAG_SCORE_THRESHOLD, RAG_K,
+    RAG_EMBEDDING_CACHE_PATH, RAG_EMBEDDING_CACHE_SIZE, RAG_EMBEDDING_CACHE_DISK_SIZE,
+    RAG_ANSWER_CACHE_THRESHOLD, RAG_ANSWER_CACHE_SIZE,
+    RAG_HYBRID_SEARCH, RAG_LEXICAL_MIN_MATCH, RAG_EMBEDDING_TIMEOUT, RAG_EMBEDDING_BACKOFF,
+    RAG_EMBEDDING_BATCH_SIZE, RAG_EMBEDDING_BATCH_WAIT_MS,
+    RAG_HNSW_EF_SEARCH, RAG_IVF_NPROBE,
+    RAG_CONTEXT_TOKEN_BUDGET, RAG_TOKENIZER_ENCODING, CHAT_BATCH_EMBEDDING_SIZE
+)
+from app.services.embedding_cache import QueryEmbeddingCache, CachedEmbeddings
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.ann_index import apply_search_params, load_index_params
+from app.services.mmap_store import SQLiteDocstore, has_mmap_store, load_mmap_store
+from app.services.store_versions import resolve_current
+from app.services.answer_cache import SemanticAnswerCache
+from app.services.context_packer import ContextPacker, TokenCounter
+from app.core.http_client import get_http_client, get_async_http_client
+from app.core.normalization import normalize_text
+from app.core.metrics import RETRIEVAL_MISSES, track_stage
+from app.services.lexical_index import BM25Index, LEXICAL_INDEX_FILE, reciprocal_rank_fusion
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
@@ -10,42 +35,132 @@ logger = get_logger(__name__)
 load_dotenv()
 
 
+def compute_index_version(vector_db_path):
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(vector_db_path)):
+        stat = os.stat(os.path.join(vector_db_path, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+
+class VectorStoreSnapshot(object):
+    # Everything tied to one loaded vector store version. Requests acquire it
+    # once and use it throughout, so a swap never changes the index under an
+    # in-flight request. Once retired, its docstore is closed by the last
+    # release (or right away when nothing holds it).
+    def __init__(self, path, vector_db, retriever, lexical_index, index_version, index_params):
+        self.path = path
+        self.vector_db = vector_db
+        self.retriever = retriever
+        self.lexical_index = lexical_index
+        self.index_version = index_version
+        self.index_params = index_params
+        self._users = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            close = self._retired and self._users == 0
+        if close:
+            self._close()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            close = self._users == 0
+        if close:
+            self._close()
+
+    def _close(self):
+        if isinstance(self.vector_db.docstore, SQLiteDocstore):
+            self.vector_db.docstore.close()
+            logger.info(f"Closed docstore of retired vector store {self.path}.")
+
+
 class RAGService(object):
-    def __init__(self, vector_db_path=RAG_VECTOR_DB_PATH, embedding_model=RAG_EMBEDDING_MODEL, score_threshold=RAG_SCORE_THRESHOLD, k=RAG_K):
+    # `embeddings` replaces the OpenAI client (e.g. the benchmark's fake
+    # backend); caching and batching are layered on top of it either way.
+    def __init__(self, vector_db_path=RAG_VECTOR_DB_PATH, embedding_model=RAG_EMBEDDING_MODEL, score_threshold=RAG_SCORE_THRESHOLD, k=RAG_K, embeddings=None):
         self.vector_db_path = vector_db_path
         self.embedding_model_name = embedding_model
+        self.base_embeddings = embeddings
 
-        self.vector_db = None
-        self.retriever = None
+        self.snapshot = None
         self.embeddings = None
+        self.embedding_cache = None
+        self.embedding_batcher = None
+        self.answer_cache = SemanticAnswerCache(
+            threshold=RAG_ANSWER_CACHE_THRESHOLD,
+            max_entries=RAG_ANSWER_CACHE_SIZE
+        )
+        self.context_packer = ContextPacker(TokenCounter(RAG_TOKENIZER_ENCODING))
         self.score_threshold = score_threshold
         self.k = k
+        self._embedding_retry_at = 0.0
+        self._reload_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
 
         self._initialize_system()
 
+    @property
+    def vector_db(self):
+        return self.snapshot.vector_db if self.snapshot else None
+
+    @property
+    def retriever(self):
+        return self.snapshot.retriever if self.snapshot else None
+
+    @property
+    def lexical_index(self):
+        return self.snapshot.lexical_index if self.snapshot else None
+
+    @property
+    def index_version(self):
+        return self.snapshot.index_version if self.snapshot else None
+
+    # Holds the current snapshot for the duration of a request; taken under
+    # the lock reload swaps with, so a retired snapshot is never re-acquired.
+    @contextmanager
+    def _use_snapshot(self):
+        with self._snapshot_lock:
+            snapshot = self.snapshot
+            if snapshot:
+                snapshot.acquire()
+        try:
+            yield snapshot
+        finally:
+            if snapshot:
+                snapshot.release()
+
     def _initialize_system(self):
         try:
             logger.info(
                 f"Loading Embedding Model: {self.embedding_model_name}...")
-            self.embeddings = OpenAIEmbeddings(
-                model=self.embedding_model_name,
-                check_embedding_ctx_length=False
+            self.embedding_cache = QueryEmbeddingCache(
+                path=RAG_EMBEDDING_CACHE_PATH,
+                memory_size=RAG_EMBEDDING_CACHE_SIZE,
+                disk_size=RAG_EMBEDDING_CACHE_DISK_SIZE
+            )
+            self.embedding_batcher = EmbeddingBatcher(
+                self.base_embeddings or self._create_embeddings(),
+                max_batch_size=RAG_EMBEDDING_BATCH_SIZE,
+                max_wait=RAG_EMBEDDING_BATCH_WAIT_MS / 1000
+            )
+            self.embeddings = CachedEmbeddings(
+                self.embedding_batcher,
+                self.embedding_cache,
+                self.embedding_model_name
             )
 
             if os.path.exists(self.vector_db_path):
-                logger.info(
-                    f"Loading FAISS Vector Store from {self.vector_db_path}...")
-                self.vector_db = FAISS.load_local(
-                    self.vector_db_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                )
-
-                self.retriever = self.vector_db.as_retriever(
-                    search_type="similarity_score_threshold",
-                    search_kwargs={
-                        "score_threshold": self.score_threshold, "k": self.k}
-                )
+                self.snapshot = self._load_snapshot(
+                    resolve_current(self.vector_db_path))
                 logger.info("RAG Service Initialized Successfully.")
             else:
                 logger.error(
@@ -54,23 +169,122 @@ class RAGService(object):
         except Exception as e:
             logger.error(f"Failed to initialize RAG Service: {e}")
 
-    def _retrieve_documents(self, query):
-        if not self.retriever:
-            logger.warning("Retriever not initialized.")
-            return []
+    def _create_embeddings(self):
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            model=self.embedding_model_name,
+            check_embedding_ctx_length=False,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
+        )
 
-        try:
-            docs = self.retriever.invoke(query)
+    def _load_snapshot(self, path):
+        if has_mmap_store(path):
+            logger.info(f"Memory-mapping FAISS Vector Store from {path}...")
+            vector_db = load_mmap_store(path, self.embeddings)
+        else:
+            logger.info(f"Loading FAISS Vector Store from {path}...")
+            vector_db = FAISS.load_local(
+                path,
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+
+        index_params = load_index_params(path)
+        applied = apply_search_params(
+            vector_db.index, index_params, ef_search=RAG_HNSW_EF_SEARCH, nprobe=RAG_IVF_NPROBE)
+        logger.info(
+            f"FAISS index type: {index_params.get('index_type')}, search params: {applied}")
 
-            if not docs:
+        lexical_index = None
+        lexical_path = os.path.join(path, LEXICAL_INDEX_FILE)
+        if RAG_HYBRID_SEARCH and os.path.exists(lexical_path):
+            loaded = BM25Index.load(lexical_path)
+            if loaded.documents or isinstance(vector_db.docstore, SQLiteDocstore):
+                lexical_index = loaded
                 logger.info(
-                    "No relevant documents found (similarity too low).")
-                return []
-            return docs
+                    f"Loaded lexical index with {len(loaded.doc_lengths)} chunks.")
 
-        except Exception as e:
-            logger.error(f"Error during retrieval: {e}")
+        retriever = vector_db.as_retriever(
+            search_type="similarity_score_threshold",
+            search_kwargs={
+                "score_threshold": self.score_threshold, "k": self.k}
+        )
+
+        return VectorStoreSnapshot(
+            path, vector_db, retriever, lexical_index,
+            compute_index_version(path), index_params
+        )
+
+    # Loads the version CURRENT points at and swaps it in; the old snapshot
+    # is retired. On failure the old snapshot stays live and the error
+    # propagates to the caller.
+    def reload(self, force=False):
+        with self._reload_lock:
+            path = resolve_current(self.vector_db_path)
+            current = self.snapshot
+            if not force and current and current.path == path \
+                    and current.index_version == compute_index_version(path):
+                return current.index_version
+
+            snapshot = self._load_snapshot(path)
+            with self._snapshot_lock:
+                current, self.snapshot = self.snapshot, snapshot
+            if current:
+                current.retire()
+            logger.info(
+                f"Vector store swapped to {path} (version {snapshot.index_version}).")
+            return snapshot.index_version
+
+    async def watch_for_updates(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                logger.error(f"Vector store reload failed, keeping current index: {e}")
+
+    def set_search_params(self, ef_search=None, nprobe=None):
+        snapshot = self.snapshot
+        if not snapshot:
+            return {}
+        applied = apply_search_params(
+            snapshot.vector_db.index, snapshot.index_params, ef_search=ef_search, nprobe=nprobe)
+        logger.info(
+            f"FAISS index type: {snapshot.index_params.get('index_type')}, search params: {applied}")
+        return applied
+
+    def _search_lexical(self, snapshot, query):
+        if not snapshot.lexical_index:
             return []
+        lookup = None
+        if not snapshot.lexical_index.documents:
+            lookup = snapshot.vector_db.docstore.search
+        with track_stage("lexical_search"):
+            return snapshot.lexical_index.search_documents(query, self.k, RAG_LEXICAL_MIN_MATCH, lookup)
+
+    def _fuse_results(self, vector_docs, lexical_docs):
+        docs = reciprocal_rank_fusion([vector_docs, lexical_docs], self.k)
+        if not docs:
+            RETRIEVAL_MISSES.inc()
+            logger.info(
+                "No relevant documents found (similarity too low).")
+        return docs
+
+    def _retrieve_documents(self, query):
+        with self._use_snapshot() as snapshot:
+            if not snapshot:
+                logger.warning("Retriever not initialized.")
+                return []
+
+            vector_docs = []
+            try:
+                with track_stage("vector_search"):
+                    vector_docs = snapshot.retriever.invoke(query)
+            except Exception as e:
+                logger.error(f"Error during retrieval: {e}")
+
+            return self._fuse_results(vector_docs, self._search_lexical(snapshot, query))
 
     def _format_docs_for_llm(self, docs):
         formatted_context = []
@@ -84,13 +298,141 @@ class RAGService(object):
 
         return "\n".join(formatted_context)
 
-    def generate_augmented_prompt(self, query):
-        docs = self._retrieve_documents(query)
+    async def _aretrieve_documents(self, query):
+        with self._use_snapshot() as snapshot:
+            if not snapshot:
+                logger.warning("Retriever not initialized.")
+                return []
 
-        if not docs:
-            return None, []
+            # The query vector is served from the embedding cache by the time
+            # the retriever asks for it. When embedding fails, only lexical
+            # results are used.
+            vector_docs = []
+            if await self.aembed_query(query) is not None:
+                try:
+                    with track_stage("vector_search"):
+                        vector_docs = await snapshot.retriever.ainvoke(query)
+                except Exception as e:
+                    logger.error(f"Error during retrieval: {e}")
+
+            return self._fuse_results(vector_docs, self._search_lexical(snapshot, query))
+
+    async def aembed_query(self, query):
+        if not self.snapshot:
+            return None
+        query = normalize_text(query)
+
+        if time.monotonic() < self._embedding_retry_at:
+            return None
+
+        try:
+            return await asyncio.wait_for(
+                self.embeddings.aembed_query(query), timeout=RAG_EMBEDDING_TIMEOUT)
+        except Exception as e:
+            logger.warning(
+                f"Embedding unavailable ({e!r}); using lexical retrieval for {RAG_EMBEDDING_BACKOFF}s.")
+            self._embedding_retry_at = time.monotonic() + RAG_EMBEDDING_BACKOFF
+            return None
+
+    # One vector (or None when embedding failed) per query, embedded in bulk.
+    async def aembed_queries(self, queries, batch_size=CHAT_BATCH_EMBEDDING_SIZE):
+        if not self.snapshot:
+            return [None] * len(queries)
+        queries = [normalize_text(query) for query in queries]
+        try:
+            with track_stage("embedding"):
+                return await self.embeddings.aembed_queries(queries, batch_size)
+        except Exception as e:
+            logger.warning(f"Batch embedding failed ({e!r}); using lexical retrieval.")
+            return [None] * len(queries)
+
+    # All query vectors in one FAISS search; same threshold as the retriever.
+    def _search_vectors(self, snapshot, vectors):
+        vector_db = snapshot.vector_db
+        matrix = np.array(vectors, dtype=np.float32)
+        if vector_db._normalize_L2:
+            faiss.normalize_L2(matrix)
+
+        with track_stage("vector_search"):
+            scores, indices = vector_db.index.search(matrix, self.k)
+
+        relevance = vector_db._select_relevance_score_fn()
+        results = []
+        for row_scores, row_indices in zip(scores, indices):
+            docs = []
+            for score, i in zip(row_scores, row_indices):
+                if i == -1 or relevance(score) < self.score_threshold:
+                    continue
+                docs.append(vector_db.docstore.search(vector_db.index_to_docstore_id[i]))
+            results.append(docs)
+        return results
+
+    async def _aretrieve_documents_batch(self, queries, vectors):
+        with self._use_snapshot() as snapshot:
+            if not snapshot:
+                logger.warning("Retriever not initialized.")
+                return [[] for _ in queries]
+
+            vector_docs = [[] for _ in queries]
+            rows = [i for i, vector in enumerate(vectors) if vector is not None]
+            if rows:
+                try:
+                    found = await asyncio.to_thread(
+                        self._search_vectors, snapshot, [vectors[i] for i in rows])
+                    for i, docs in zip(rows, found):
+                        vector_docs[i] = docs
+                except Exception as e:
+                    logger.error(f"Error during batch retrieval: {e}")
 
-        context_str = self._format_docs_for_llm(docs)
+            return [self._fuse_results(docs, self._search_lexical(snapshot, query))
+                    for query, docs in zip(queries, vector_docs)]
+
+    # Bulk counterpart of agenerate_augmented_prompt: (instruction, docs) per
+    # query, with (None, []) where nothing relevant was found.
+    async def agenerate_augmented_prompts(self, queries):
+        queries = [normalize_text(query) for query in queries]
+        vectors = await self.aembed_queries(queries)
+        prompts = []
+        for docs in await self._aretrieve_documents_batch(queries, vectors):
+            prompts.append(self._build_system_instruction(docs) if docs else (None, []))
+        return prompts
+
+    # Goes straight to the embedding API (no cache, no batching) so the
+    # connection pool is exercised without storing a probe vector.
+    async def awarm_up(self):
+        if not self.embedding_batcher:
+            return False
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                self.embedding_batcher.embeddings.aembed_query("warm-up"),
+                timeout=RAG_EMBEDDING_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Embedding warm-up failed: {e!r}")
+            return False
+        logger.info(f"Embedding warm-up took {time.perf_counter() - start:.2f}s")
+        return True
+
+    async def alookup_cached_answer(self, query):
+        version = self.index_version
+        vector = await self.aembed_query(query)
+        if vector is None:
+            return None
+        return self.answer_cache.get(vector, version)
+
+    # index_version is the version the answer was generated against; answers
+    # that finish after a swap are not cached.
+    async def astore_cached_answer(self, query, answer, sources, index_version):
+        if index_version != self.index_version:
+            return
+        vector = await self.aembed_query(query)
+        if vector is not None:
+            self.answer_cache.put(vector, index_version, answer, sources)
+
+    def _build_system_instruction(self, docs):
+        with track_stage("prompt"):
+            passages, docs = self.context_packer.pack(docs, RAG_CONTEXT_TOKEN_BUDGET)
+            context_str = self._format_docs_for_llm(passages)
 
         system_instruction = f"""تو هوش مصنوعی پاسخگو به سوالات آموزشی دانشگاه صنعتی شریف هستی.
                             وظیفه تو پاسخ دادن به سوالات دانشجوها *صرفاً* بر اساس متون زیر است.
@@ -108,6 +450,25 @@ class RAGService(object):
                             """
         return system_instruction, docs
 
+    # Queries are normalized like the indexed documents (see
+    # app/core/normalization.py) before embedding, lexical search and the
+    # answer cache, so spelling variants of a question share one cache entry.
+    def generate_augmented_prompt(self, query):
+        docs = self._retrieve_documents(normalize_text(query))
+
+        if not docs:
+            return None, []
+
+        return self._build_system_instruction(docs)
+
+    async def agenerate_augmented_prompt(self, query):
+        docs = await self._aretrieve_documents(normalize_text(query))
+
+        if not docs:
+            return None, []
+
+        return self._build_system_instruction(docs)
+
 
 if __name__ == "__main__":
     service = RAGService()
@@ -0,0 +1,46 @@
+import os
+import shutil
+from datetime import datetime
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+
+
+# A vector store directory either holds the index files directly (legacy
+# layout) or a versions/ folder plus a CURRENT file naming the live version.
+def resolve_current(base_path):
+    pointer = os.path.join(base_path, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return base_path
+    with open(pointer, "r", encoding="utf-8") as f:
+        return os.path.join(base_path, VERSIONS_DIR, f.read().strip())
+
+
+def new_version_dir(base_path):
+    name = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = os.path.join(base_path, VERSIONS_DIR, name)
+    os.makedirs(path)
+    return name, path
+
+
+def publish_version(base_path, name):
+    pointer = os.path.join(base_path, CURRENT_FILE)
+    tmp_pointer = pointer + ".tmp"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(tmp_pointer, pointer)
+
+
+# Processes that still have an old version open keep working after it is
+# removed: mmapped files and open SQLite handles outlive the unlink.
+def prune_versions(base_path, keep):
+    versions_dir = os.path.join(base_path, VERSIONS_DIR)
+    current = os.path.basename(resolve_current(base_path))
+    names = sorted(os.listdir(versions_dir), reverse=True)
+
+    removed = []
+    for name in names[keep:]:
+        if name != current:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+            removed.append(name)
+    return removed
@@ -1,4 +1,19 @@
+import os
+import shutil
+
 import uvicorn
 
+from app.core.config import WEB_WORKERS, WEB_RELOAD, PROMETHEUS_MULTIPROC_DIR
+
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    # Files left by a previous run would be summed into the new counters.
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=WEB_WORKERS,
+        reload=WEB_RELOAD and WEB_WORKERS == 1
+    )